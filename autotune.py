@@ -0,0 +1,163 @@
+"""Parallel parameter sweep for detect_lines
+
+Runs detect_lines -> detect_lanes -> get_lane_center over a frame directory for
+every combination of threshold1, threshold2, minLineLength, maxLineGap and blur
+size, spread over a process pool. Each parameter set is scored on how often it
+finds a lane, how much the lane center jumps between consecutive frames and its
+per-frame latency. The Pareto front of those three is reported.
+
+    python autotune.py vidFrames --workers 4 --output tune.json
+"""
+import argparse
+import glob
+import itertools
+import json
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import cv2
+import numpy as np
+
+import frame_dataset
+import lane_detection
+import lane_following
+
+# parameter sets hard-coded around the repo, always scored alongside the grid
+KNOWN_PARAMS = [(30, 100, 3, 229, 13, 10), (50, 70, 3, 200, 10, 10), (50, 50, 3, 100, 10, 10)]
+
+_frames = None
+
+
+def load_frames(paths, crop = True):
+    """Decodes frames the way the video loops see them
+    args:
+        paths (list or str): image paths, or a frame_dataset file whose frames are mapped instead of decoded
+        crop (bool): resize to 1912x1069 and keep the bottom half, like lane_following.process_frame (default True)
+    returns:
+        (list): list of np.ndarray frames
+    """
+    if frame_dataset.is_dataset(paths):
+        images = frame_dataset.FrameDataset(paths)
+    else:
+        images = (cv2.imread(path) for path in paths)
+    frames = []
+    for img in images:
+        if img is None:
+            continue
+        if crop:
+            img = cv2.resize(img, (1912, 1069))
+            img = np.ascontiguousarray(img[int(img.shape[0]/2):])
+        frames.append(img)
+    return frames
+
+def _init_worker(paths, crop):
+    # every worker decodes the frames once instead of receiving them per task
+    global _frames
+    cv2.setNumThreads(1)
+    _frames = load_frames(paths, crop)
+
+
+def score(params, frames = None):
+    """Scores one parameter set over a sequence of frames
+    args:
+        params (tuple): threshold1, threshold2, apertureSize, minLineLength, maxLineGap, blurSize
+        frames (list): frames in video order (default: the frames loaded by the worker)
+    returns:
+        (dict): {"params", "detection_rate", "jitter", "p50_ms", "mean_ms"}
+            jitter is the mean absolute change in lane center intercept between consecutive frames (None if never measured)
+    """
+    if frames is None:
+        frames = _frames
+    times = []
+    found = 0
+    centers = []
+    for frame in frames:
+        img = frame.copy()
+        start = time.perf_counter()
+        lines = lane_detection.detect_lines(img, *params)
+        lanes = lane_detection.detect_lanes(img, lines)
+        center = lane_following.get_lane_center(img, lanes) if len(lanes) != 0 else None
+        times.append(time.perf_counter() - start)
+        if center is not None:
+            found += 1
+        centers.append(None if center is None else center[1])
+
+    jumps = [abs(a - b) for a, b in zip(centers, centers[1:]) if a is not None and b is not None]
+    ms = np.asarray(times) * 1000
+    return {
+        "params": list(params),
+        "detection_rate": found / len(frames) if frames else 0.0,
+        "jitter": float(np.mean(jumps)) if jumps else None,
+        "p50_ms": float(np.median(ms)) if len(ms) else 0.0,
+        "mean_ms": float(ms.mean()) if len(ms) else 0.0,
+    }
+
+
+def grid(threshold1s, threshold2s, minLineLengths, maxLineGaps, blurSizes, apertureSize = 3):
+    """Returns every parameter combination (plus KNOWN_PARAMS) as detect_lines argument tuples"""
+    combos = [(t1, t2, apertureSize, length, gap, blur)
+              for t1, t2, length, gap, blur in itertools.product(threshold1s, threshold2s, minLineLengths, maxLineGaps, blurSizes)
+              if t1 <= t2]
+    return list(dict.fromkeys(combos + KNOWN_PARAMS))
+
+
+def _dominates(a, b):
+    # a is at least as good as b in everything and better in something
+    jitterA = float('inf') if a["jitter"] is None else a["jitter"]
+    jitterB = float('inf') if b["jitter"] is None else b["jitter"]
+    noWorse = a["detection_rate"] >= b["detection_rate"] and jitterA <= jitterB and a["p50_ms"] <= b["p50_ms"]
+    better = a["detection_rate"] > b["detection_rate"] or jitterA < jitterB or a["p50_ms"] < b["p50_ms"]
+    return noWorse and better
+
+def pareto_front(results):
+    """Returns the results no other result beats on detection rate, jitter and latency at once, fastest first"""
+    front = [r for r in results if not any(_dominates(other, r) for other in results)]
+    return sorted(front, key=lambda r: r["p50_ms"])
+
+
+def sweep(paths, paramSets, workers = None, crop = True):
+    """Scores every parameter set on a process pool
+    args:
+        paths (list or str): frame image paths in video order, or a frame_dataset file
+        paramSets (list): detect_lines argument tuples
+        workers (int): number of processes (default: number of CPUs)
+        crop (bool): score on the 1912x535 bottom-half crop the video loops use (default True)
+    returns:
+        (list): score() results in the order of paramSets
+    """
+    with ProcessPoolExecutor(max_workers=workers, initializer=_init_worker, initargs=(paths, crop)) as pool:
+        return list(pool.map(score, paramSets, chunksize=max(1, len(paramSets) // (4 * (workers or os.cpu_count() or 1)))))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Parallel parameter sweep for detect_lines")
+    parser.add_argument("frames", nargs="?", default="vidFrames", help="directory of frames in video order, or a frame_dataset file")
+    parser.add_argument("--threshold1", type=int, nargs="+", default=[30, 50])
+    parser.add_argument("--threshold2", type=int, nargs="+", default=[50, 70, 100, 150])
+    parser.add_argument("--min-line-length", type=int, nargs="+", default=[100, 200, 229])
+    parser.add_argument("--max-line-gap", type=int, nargs="+", default=[10, 13, 20])
+    parser.add_argument("--blur", type=int, nargs="+", default=[5, 10, 15])
+    parser.add_argument("--workers", type=int, default=None, help="number of processes (default: CPU count)")
+    parser.add_argument("--no-crop", action="store_true", help="score on the full frame instead of the bottom-half crop")
+    parser.add_argument("--output", type=str, help="write all scores and the Pareto front to this JSON file")
+    args = parser.parse_args()
+
+    if frame_dataset.is_dataset(args.frames):
+        paths = args.frames
+        frameCount = len(frame_dataset.FrameDataset(paths))
+    else:
+        paths = sorted(glob.glob(os.path.join(args.frames, "*.jpg")))
+        frameCount = len(paths)
+    paramSets = grid(args.threshold1, args.threshold2, args.min_line_length, args.max_line_gap, args.blur)
+    print(f"Scoring {len(paramSets)} parameter sets on {frameCount} frames")
+    results = sweep(paths, paramSets, args.workers, not args.no_crop)
+    front = pareto_front(results)
+
+    print(f"{'params':<32}{'found':>8}{'jitter':>10}{'p50 ms':>9}")
+    for r in front:
+        jitter = "-" if r["jitter"] is None else f"{r['jitter']:.1f}"
+        print(f"{str(tuple(r['params'])):<32}{r['detection_rate']:8.0%}{jitter:>10}{r['p50_ms']:9.2f}")
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump({"frames": paths, "results": results, "pareto_front": front}, f, indent=2)
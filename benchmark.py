@@ -0,0 +1,349 @@
+"""Per-stage latency benchmark for lane_detection / lane_following
+
+Runs every stage of detect_lines (grayscale, blur, Otsu threshold, Canny,
+HoughLinesP, drawing) plus detect_lanes and get_lane_center over the bundled
+frames at several resolutions and reports p50/p95/p99 latency and fps.
+
+    python benchmark.py --output bench.json
+    python benchmark.py --output new.json --compare bench.json
+    python benchmark.py --imports
+"""
+import argparse
+import glob
+import json
+import os
+import platform
+import subprocess
+import sys
+import time
+
+import cv2
+import numpy as np
+
+import frame_dataset
+import lane_detection
+import lane_following
+
+DEFAULT_IMAGES = sorted(glob.glob('vidFrames/*.jpg')) + ['516.jpg', '2174.jpg', 'aaaaaa.jpg']
+DETECT_ARGS = (50, 70, 3, 200, 10)
+
+
+# modules the control process and pool workers import, and what they must not drag in
+CORE_MODULES = ["lane_detection", "lane_following", "lane_tracking", "video_follow", "video_camera"]
+HEAVY_MODULES = ["matplotlib", "gi"]
+
+_IMPORT_SNIPPET = """
+import json, sys, time
+start = time.perf_counter()
+import {module}
+ms = (time.perf_counter() - start) * 1000
+print(json.dumps({{"ms": ms, "heavy": [name for name in {heavy!r} if name in sys.modules]}}))
+"""
+
+
+def import_times(modules = CORE_MODULES, repeats = 3):
+    """Times importing each module in a fresh interpreter
+    args:
+        modules (list): module names
+        repeats (int): interpreters started per module, the fastest is kept to cut disk cache noise (default 3)
+    returns:
+        (dict): {module: {"ms", "heavy"}}, heavy lists the HEAVY_MODULES the import pulled in
+    """
+    here = os.path.dirname(os.path.abspath(__file__))
+    results = {}
+    for module in modules:
+        runs = []
+        for _ in range(repeats):
+            out = subprocess.run([sys.executable, "-c", _IMPORT_SNIPPET.format(module=module, heavy=HEAVY_MODULES)],
+                                 cwd=here, capture_output=True, text=True, check=True).stdout
+            runs.append(json.loads(out))
+        results[module] = min(runs, key=lambda r: r["ms"])
+    return results
+
+def read_images(images):
+    """Returns the frames of image paths, frame_dataset files among them are mapped instead of decoded"""
+    frames = []
+    for path in images:
+        if frame_dataset.is_dataset(path):
+            frames.extend(frame_dataset.FrameDataset(path))
+        else:
+            img = cv2.imread(path)
+            if img is not None:
+                frames.append(img)
+    return frames
+
+def _full(img):
+    return cv2.resize(img, (1912, 1069))
+
+def _crop(img):
+    resized = cv2.resize(img, (1912, 1069))
+    return np.ascontiguousarray(resized[int(resized.shape[0]/2):])
+
+def _half(img):
+    return cv2.resize(img, (956, 534))
+
+# name -> function making the benchmark input from a decoded image
+RESOLUTIONS = {
+    'native': lambda img: img,
+    '1912x1069': _full,
+    '1912x535-crop': _crop,
+    '956x534': _half,
+}
+
+
+def summarize(times):
+    """Returns latency percentiles (ms) and fps for a list of durations
+    args:
+        times (list): durations in seconds
+    returns:
+        (dict): {"n", "mean_ms", "p50_ms", "p95_ms", "p99_ms", "fps"}
+    """
+    if len(times) == 0:
+        return {"n": 0}
+    ms = np.asarray(times) * 1000
+    p50, p95, p99 = np.percentile(ms, [50, 95, 99])
+    return {
+        "n": len(ms),
+        "mean_ms": float(ms.mean()),
+        "p50_ms": float(p50),
+        "p95_ms": float(p95),
+        "p99_ms": float(p99),
+        "fps": float(1000 / ms.mean()) if ms.mean() > 0 else float('inf'),
+    }
+
+
+def time_stages(img, detectArgs = DETECT_ARGS):
+    """Times each stage of the detection pipeline once on an image
+    args:
+        img (np.ndarray): BGR image
+        detectArgs (tuple): threshold1, threshold2, apertureSize, minLineLength, maxLineGap (, blurSize)
+    returns:
+        (dict): stage name -> duration in seconds
+    """
+    threshold1, threshold2, apertureSize, minLineLength, maxLineGap = detectArgs[:5]
+    blurSize = detectArgs[5] if len(detectArgs) > 5 else 10
+    times = {}
+    clock = time.perf_counter
+
+    # same steps as lane_detection.detect_lines, timed one by one
+    start = clock()
+    grayimg = cv2.cvtColor(img, cv2.COLOR_BGR2GRAY)
+    times['gray'] = clock() - start
+    start = clock()
+    imgblur = cv2.blur(grayimg, [blurSize, blurSize])
+    times['blur'] = clock() - start
+    start = clock()
+    (thresh, im_bw) = cv2.threshold(imgblur, 128, 255, cv2.THRESH_BINARY | cv2.THRESH_OTSU)
+    times['threshold'] = clock() - start
+    start = clock()
+    edges = cv2.Canny(im_bw, threshold1, threshold2, apertureSize=apertureSize)
+    times['canny'] = clock() - start
+    start = clock()
+    lines = cv2.HoughLinesP(edges, 1, np.pi/180, 100, minLineLength=minLineLength, maxLineGap=maxLineGap)
+    times['hough'] = clock() - start
+    drawn = img.copy() # detect_lines draws on the image itself, the copy isn't part of drawing
+    start = clock()
+    if lines is not None:
+        for line in lines:
+            x1, y1, x2, y2 = line[0]
+            cv2.line(drawn, (x1, y1), (x2, y2), (0, 255, 0), 2)
+    times['draw'] = clock() - start
+
+    work = img.copy()
+    start = clock()
+    lines = lane_detection.detect_lines(work, *detectArgs)
+    times['detect_lines'] = clock() - start
+    start = clock()
+    lanes = lane_detection.detect_lanes(work, lines)
+    times['detect_lanes'] = clock() - start
+    if len(lanes) != 0:
+        start = clock()
+        lane_following.get_lane_center(work, lanes)
+        times['get_lane_center'] = clock() - start
+    return times
+
+
+def run(images = DEFAULT_IMAGES, resolutions = RESOLUTIONS, repeats = 5, detectArgs = DETECT_ARGS):
+    """Benchmarks every stage over images at each resolution
+    args:
+        images (list): image paths and frame_dataset files
+        resolutions (dict): name -> function that makes the input image from a decoded image
+        repeats (int): times each image is run per resolution (default 5)
+        detectArgs (tuple): parameters passed to detect_lines
+    returns:
+        (dict): machine readable results, {"meta": {...}, "results": {resolution: {stage: summary}}}
+    """
+    decoded = read_images(images)
+    results = {}
+    for name, make in resolutions.items():
+        inputs = [make(img) for img in decoded]
+        stageTimes = {}
+        time_stages(inputs[0], detectArgs) # warm up
+        for _ in range(repeats):
+            for img in inputs:
+                for stage, duration in time_stages(img, detectArgs).items():
+                    stageTimes.setdefault(stage, []).append(duration)
+        results[name] = {stage: summarize(times) for stage, times in stageTimes.items()}
+    meta = {
+        "time": time.strftime('%Y-%m-%dT%H:%M:%S'),
+        "python": platform.python_version(),
+        "opencv": cv2.__version__,
+        "machine": platform.machine(),
+        "cpus": os.cpu_count(),
+        "images": len(decoded),
+        "repeats": repeats,
+        "detect_args": list(detectArgs),
+    }
+    return {"meta": meta, "results": results}
+
+
+def _line_distance(line, other):
+    # mean distance of line's endpoints to the infinite line through other
+    x1, y1, x2, y2 = [float(v) for v in other]
+    length = np.hypot(x2 - x1, y2 - y1) or 1.0
+    return np.mean([abs((x2 - x1) * (y1 - py) - (x1 - px) * (y2 - y1)) / length for px, py in (line[:2], line[2:])])
+
+def compare_engines(images = DEFAULT_IMAGES, repeats = 5, detectArgs = DETECT_ARGS, tolerance = 10):
+    """Compares detect_lines (HoughLinesP) with detect_lines_ransac on the 1912x535 crop,
+    ransac_seeded is detect_lines_ransac seeded with its lines from the previous image like LaneTracker(engine='ransac')
+    args:
+        images (list): image paths
+        repeats (int): times each image is run (default 5)
+        detectArgs (tuple): parameters passed to both engines
+        tolerance (float): pixels a line or lane center may be off and still agree (default 10)
+    returns:
+        (dict): {"hough": summary, "ransac": summary, "ransac_seeded": summary, "agreement": {...}, "seeded_agreement": {...}}
+            line_recall: share of Hough lines that have a RANSAC line within tolerance
+            lanes_found: share of frames where both or neither engine found a lane
+            center: share of frames with a lane in both where the center intercepts are within tolerance * 5
+    """
+    threshold1, threshold2, apertureSize, minLineLength, maxLineGap = detectArgs[:5]
+    blurSize = detectArgs[5] if len(detectArgs) > 5 else 10
+    times = {"hough": [], "ransac": [], "ransac_seeded": []}
+    counts = {name: {"matched": 0, "sameFound": 0, "bothFound": 0, "sameCenter": 0} for name in ("ransac", "ransac_seeded")}
+    houghLines = 0
+    seedLines = None
+    inputs = [_crop(img) for img in read_images(images)]
+    for img in inputs:
+        results = {}
+        for _ in range(repeats):
+            # share the edge image so only the line finding itself is compared
+            frame = lane_detection.FrameContext(img.copy())
+            frame.edges(threshold1, threshold2, apertureSize, blurSize)
+            start = time.perf_counter()
+            results["hough"] = lane_detection.detect_lines(frame, *detectArgs)
+            times["hough"].append(time.perf_counter() - start)
+            start = time.perf_counter()
+            results["ransac"] = lane_detection.detect_lines_ransac(frame, threshold1, threshold2, apertureSize, minLineLength, maxLineGap, blurSize)
+            times["ransac"].append(time.perf_counter() - start)
+            start = time.perf_counter()
+            results["ransac_seeded"] = lane_detection.detect_lines_ransac(frame, threshold1, threshold2, apertureSize, minLineLength, maxLineGap, blurSize,
+                                                                          seedLines = seedLines)
+            times["ransac_seeded"].append(time.perf_counter() - start)
+        seedLines = results["ransac_seeded"]
+
+        hough = results["hough"]
+        houghLines += len(hough)
+        houghLanes = lane_detection.detect_lanes(img, hough)
+        for name, count in counts.items():
+            count["matched"] += sum(1 for line in hough if any(_line_distance(line, other) <= tolerance for other in results[name]))
+            lanes = lane_detection.detect_lanes(img, results[name])
+            count["sameFound"] += (len(houghLanes) != 0) == (len(lanes) != 0)
+            if len(houghLanes) != 0 and len(lanes) != 0:
+                count["bothFound"] += 1
+                centers = [lane_following.get_lane_center(img, found) for found in (houghLanes, lanes)]
+                count["sameCenter"] += abs(centers[0][1] - centers[1][1]) <= tolerance * 5
+
+    def agreement(count):
+        return {
+            "line_recall": count["matched"] / houghLines if houghLines else None,
+            "lanes_found": count["sameFound"] / len(inputs) if inputs else None,
+            "center": float(count["sameCenter"] / count["bothFound"]) if count["bothFound"] else None,
+        }
+
+    return {
+        "hough": summarize(times["hough"]),
+        "ransac": summarize(times["ransac"]),
+        "ransac_seeded": summarize(times["ransac_seeded"]),
+        "agreement": agreement(counts["ransac"]),
+        "seeded_agreement": agreement(counts["ransac_seeded"]),
+    }
+
+
+def compare(new, old, tolerance = 0.2):
+    """Finds stages that got slower than a previous run
+    args:
+        new (dict): results from run()
+        old (dict): results from an earlier run()
+        tolerance (float): allowed relative increase of p50 latency (default 0.2)
+    returns:
+        (list): [(resolution, stage, old p50 ms, new p50 ms), ...] of the stages that slowed down
+    """
+    slower = []
+    for name, stages in new["results"].items():
+        for stage, summary in stages.items():
+            before = old["results"].get(name, {}).get(stage)
+            if not before or "p50_ms" not in before or "p50_ms" not in summary:
+                continue
+            if summary["p50_ms"] > before["p50_ms"] * (1 + tolerance):
+                slower.append((name, stage, before["p50_ms"], summary["p50_ms"]))
+    return slower
+
+
+def print_report(report):
+    for name, stages in report["results"].items():
+        print(f"\n{name}")
+        print(f"  {'stage':<16}{'p50 ms':>9}{'p95 ms':>9}{'p99 ms':>9}{'fps':>9}")
+        for stage, s in stages.items():
+            if s["n"]:
+                print(f"  {stage:<16}{s['p50_ms']:9.2f}{s['p95_ms']:9.2f}{s['p99_ms']:9.2f}{s['fps']:9.1f}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Lane detection per-stage latency benchmark")
+    parser.add_argument("images", nargs="*", default=DEFAULT_IMAGES, help="images or frame_dataset files to run on (default: vidFrames and sample images)")
+    parser.add_argument("--repeats", type=int, default=5, help="runs per image and resolution")
+    parser.add_argument("--output", type=str, help="write JSON results to this file")
+    parser.add_argument("--compare", type=str, help="JSON results of an earlier run to check for slowdowns")
+    parser.add_argument("--tolerance", type=float, default=0.2, help="allowed relative p50 slowdown for --compare")
+    parser.add_argument("--engines", action="store_true", help="compare the Hough and RANSAC line engines instead")
+    parser.add_argument("--imports", action="store_true", help="time importing the core modules instead")
+    parser.add_argument("--import-budget", type=float, default=500, help="ms an import may take for --imports")
+    args = parser.parse_args()
+
+    if args.imports:
+        times = import_times(repeats=args.repeats)
+        failed = False
+        for module, result in times.items():
+            problems = [f"imports {name}" for name in result["heavy"]]
+            if result["ms"] > args.import_budget:
+                problems.append(f"over {args.import_budget:.0f} ms")
+            failed = failed or bool(problems)
+            print(f"{module:<16}{result['ms']:9.1f} ms  {'FAIL ' + ', '.join(problems) if problems else 'ok'}")
+        if args.output:
+            with open(args.output, 'w') as f:
+                json.dump(times, f, indent=2)
+        sys.exit(1 if failed else 0)
+
+    if args.engines:
+        engines = compare_engines(args.images, args.repeats)
+        for name in ("hough", "ransac", "ransac_seeded"):
+            print(f"{name:<14} p50 {engines[name]['p50_ms']:.2f} ms  p95 {engines[name]['p95_ms']:.2f} ms  {engines[name]['fps']:.1f} fps")
+        print(f"agreement {engines['agreement']}")
+        print(f"seeded agreement {engines['seeded_agreement']}")
+        if args.output:
+            with open(args.output, 'w') as f:
+                json.dump(engines, f, indent=2)
+        sys.exit(0)
+
+    report = run(args.images, repeats=args.repeats)
+    print_report(report)
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(report, f, indent=2)
+    if args.compare:
+        with open(args.compare) as f:
+            slower = compare(report, json.load(f), args.tolerance)
+        for name, stage, before, after in slower:
+            print(f"SLOWER {name} {stage}: {before:.2f} ms -> {after:.2f} ms")
+        sys.exit(1 if slower else 0)
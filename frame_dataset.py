@@ -0,0 +1,122 @@
+"""Memory-mapped frame datasets for fast offline evaluation
+
+A frame directory or video is decoded once into a single raw uint8 file of shape
+(frames, height, width, 3) plus a small JSON index with the shape, the source
+name and timestamp of every frame. Loading it maps the file instead of decoding
+JPEGs, so repeated benchmark / tuning / regression runs only pay for detection.
+
+    python frame_dataset.py vidFrames vidFrames.frames
+    dataset = FrameDataset('vidFrames.frames')
+    lines = lane_detection.detect_lines(dataset[0].copy(), 50, 70, 3, 200, 10)
+"""
+import argparse
+import glob
+import json
+import os
+
+import cv2
+import numpy as np
+
+EXTENSION = '.frames'
+
+
+def is_dataset(path):
+    """Returns True if path is a frame dataset built by build_dataset"""
+    return isinstance(path, str) and path.endswith(EXTENSION) and os.path.exists(path + '.json')
+
+
+def _source_frames(source):
+    # yields (name, timestamp in seconds, frame) from a frame directory or a video file
+    if os.path.isdir(source):
+        for path in sorted(glob.glob(os.path.join(source, '*.jpg')) + glob.glob(os.path.join(source, '*.png'))):
+            frame = cv2.imread(path)
+            if frame is not None:
+                yield os.path.basename(path), os.path.getmtime(path), frame
+        return
+    vid = cv2.VideoCapture(source)
+    index = 0
+    while True:
+        ret, frame = vid.read()
+        if not ret:
+            break
+        yield f"{os.path.basename(source)}:{index}", vid.get(cv2.CAP_PROP_POS_MSEC) / 1000, frame
+        index += 1
+    vid.release()
+
+
+def build_dataset(source, path, size = None):
+    """Decodes a frame directory or video into a memory-mappable dataset file
+    args:
+        source (str): frame directory or video file
+        path (str): dataset file to write, should end in .frames (the index goes to path + '.json')
+        size (tuple): (width, height) to resize every frame to (default: size of the first frame)
+    returns:
+        (FrameDataset): the new dataset
+    """
+    names = []
+    timestamps = []
+    shape = None
+    with open(path, 'wb') as f:
+        for name, timestamp, frame in _source_frames(source):
+            if shape is None:
+                size = size or (frame.shape[1], frame.shape[0])
+                shape = (size[1], size[0], 3)
+            if frame.shape != shape:
+                frame = cv2.resize(frame, size)
+            f.write(np.ascontiguousarray(frame, dtype=np.uint8).tobytes())
+            names.append(name)
+            timestamps.append(timestamp)
+
+    index = {
+        "source": source,
+        "shape": [len(names)] + list(shape or (0, 0, 3)),
+        "dtype": "uint8",
+        "names": names,
+        "timestamps": timestamps,
+    }
+    with open(path + '.json', 'w') as f:
+        json.dump(index, f, indent=1)
+    return FrameDataset(path)
+
+
+class FrameDataset():
+    """Random access, zero-copy view of a dataset written by build_dataset
+
+    Frames are read-only views into the mapped file; copy a frame before
+    anything draws on it (detect_lines does unless lane_detection.set_drawing(False)).
+    args:
+        path (str): dataset file
+    """
+
+    def __init__(self, path):
+        with open(path + '.json') as f:
+            index = json.load(f)
+        self.path = path
+        self.source = index["source"]
+        self.names = index["names"]
+        self.timestamps = index["timestamps"]
+        self.shape = tuple(index["shape"])
+        if self.shape[0] == 0:
+            self.frames = np.empty(self.shape, dtype=np.uint8)
+        else:
+            self.frames = np.memmap(path, dtype=np.uint8, mode='r', shape=self.shape)
+
+    def __len__(self):
+        return self.shape[0]
+
+    def __getitem__(self, index):
+        return self.frames[index]
+
+    def __iter__(self):
+        return iter(self.frames)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Build a memory-mapped frame dataset")
+    parser.add_argument("source", help="frame directory or video file")
+    parser.add_argument("output", help="dataset file to write, e.g. vidFrames.frames")
+    parser.add_argument("--size", type=int, nargs=2, metavar=("WIDTH", "HEIGHT"), help="resize frames to this size")
+    args = parser.parse_args()
+
+    dataset = build_dataset(args.source, args.output, tuple(args.size) if args.size else None)
+    print(f"Wrote {len(dataset)} frames of {dataset.shape[1:]} to {args.output}")
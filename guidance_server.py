@@ -0,0 +1,200 @@
+"""Publishes lane guidance from one detection loop to any number of local clients
+
+One detection loop runs over a runner.FrameSource (the BlueRov UDP stream, an
+RTSP URL, a video file, frame directory or frame dataset). Each frame's lines,
+lanes, lane center slope / intercept, angle and recommended direction become
+one JSON line, kept in a single-message mailbox per client connected over TCP or
+a Unix socket. A client sends a newline whenever it wants guidance and gets the
+newest message back (waiting for the next frame if it already has that one).
+Nothing is sent unasked, so no matter how slowly a client reads, messages never
+queue up in socket buffers and it never holds up detection or other clients.
+
+    python guidance_server.py udp:5600 --port 8765
+    python guidance_server.py vidFrames --unix /tmp/guidance.sock --rate 10
+    nc localhost 8765    # press enter for each message
+"""
+import argparse
+import asyncio
+import json
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import lane_detection
+import lane_following
+import runner
+
+
+class _Client():
+    # latest-message mailbox of one connected client
+    def __init__(self, writer):
+        self.writer = writer
+        self.message = None
+        self.sent = 0
+        self.skipped = 0
+        self.ready = asyncio.Event()
+
+    def offer(self, message):
+        if self.message is not None:
+            self.skipped += 1
+        self.message = message
+        self.ready.set()
+
+
+class GuidanceServer():
+    """Runs detection on a source and fans each result out to the connected clients
+    args:
+        source (str or runner.FrameSource): anything runner.FrameSource accepts
+        detectArgs (tuple): parameters passed to detect_lines (default runner.DETECT_ARGS)
+        rate (float): maximum frames per second to process, 0 processes every frame as it comes (default 0)
+        preprocess (bool): crop before resizing into reused lane_detection.Preprocessor buffers, faster but against the
+            exact resize-then-crop path it finds only 50% of the lanes and 1 in 3 of its lanes are phantoms (regression.py) (default False)
+    """
+
+    def __init__(self, source, detectArgs = runner.DETECT_ARGS, rate = 0, preprocess = False):
+        self.frames = source if isinstance(source, runner.FrameSource) else runner.FrameSource(source)
+        self.detectArgs = detectArgs
+        self.rate = rate
+        self.sequence = 0
+        self.clients = set()
+        self.preprocess = preprocess
+        self._preprocessor = None
+        # one thread, so the Preprocessor buffers and the source are only ever used from it
+        self._executor = ThreadPoolExecutor(max_workers=1)
+
+    def _next(self):
+        # read and analyze one frame off the event loop, None once the source has ended
+        frame, timestamp = self.frames.read()
+        if frame is None:
+            return None
+        start = time.perf_counter()
+        size = (frame.shape[1], frame.shape[0])
+        if self.preprocess and (self._preprocessor is None or self._preprocessor.inputSize != size):
+            self._preprocessor = lane_detection.Preprocessor(size, detectArgs = self.detectArgs)
+        result = lane_following.analyze_frame(frame, self.detectArgs, preprocessor = self._preprocessor)
+        center = result["center"]
+        self.sequence += 1
+        message = {
+            "seq": self.sequence,
+            "time": time.time(),
+            "frame_time": timestamp,
+            "latency_ms": round((time.perf_counter() - start) * 1000, 2),
+            "lines": result["lines"],
+            "lanes": result["lanes"],
+            "slope": None if center is None else center[0],
+            "intercept": None if center is None else center[1],
+            "angle": None if center is None else float(lane_following.recommend_angle(center[0])),
+            "direction": result["direction"] and result["direction"][0],
+        }
+        return (json.dumps(message, separators=(',', ':')) + "\n").encode()
+
+    def publish(self, message):
+        """Hands an encoded message to every client, replacing any message a client hasn't sent yet"""
+        for client in self.clients:
+            client.offer(message)
+
+    async def _serve_client(self, reader, writer):
+        client = _Client(writer)
+        self.clients.add(client)
+        try:
+            # every line the client sends asks for the newest message
+            while await reader.readline():
+                await client.ready.wait()
+                client.ready.clear()
+                message, client.message = client.message, None
+                if message is None: # stop() wakes clients up with nothing to send
+                    break
+                writer.write(message)
+                await writer.drain()
+                client.sent += 1
+        except (ConnectionError, asyncio.CancelledError):
+            pass
+        finally:
+            self.clients.discard(client)
+            writer.close()
+
+    async def detect(self):
+        """Runs the detection loop until the source ends"""
+        loop = asyncio.get_running_loop()
+        period = 1 / self.rate if self.rate else 0
+        nextTime = loop.time()
+        while True:
+            message = await loop.run_in_executor(self._executor, self._next)
+            if message is None:
+                break
+            self.publish(message)
+            nextTime += period
+            delay = nextTime - loop.time()
+            if delay > 0:
+                await asyncio.sleep(delay)
+            else:
+                nextTime = loop.time()
+
+    async def serve(self, host = '127.0.0.1', port = 8765, path = None):
+        """Accepts clients and runs detection until the source ends
+        args:
+            host (str): TCP address to listen on (default '127.0.0.1')
+            port (int): TCP port to listen on (default 8765)
+            path (str): listen on this Unix socket instead of TCP (default None)
+        """
+        if path:
+            server = await asyncio.start_unix_server(self._serve_client, path)
+        else:
+            server = await asyncio.start_server(self._serve_client, host, port)
+        async with server:
+            try:
+                await self.detect()
+            finally:
+                server.close()
+                self.stop()
+
+    def stop(self):
+        """Releases the source and closes every client connection"""
+        for client in list(self.clients):
+            client.offer(None) # wakes up clients waiting for a message
+            client.writer.close() # and ends the ones waiting for a request
+        # release on the detection thread, after any read still running there, and wait for it
+        self._executor.submit(self.frames.release)
+        self._executor.shutdown(wait=True)
+
+
+async def subscribe(host = '127.0.0.1', port = 8765, path = None):
+    """Connects to a GuidanceServer and yields its messages as dicts, each one asked for once the previous one was consumed
+    args:
+        host (str): server address (default '127.0.0.1')
+        port (int): server TCP port (default 8765)
+        path (str): server Unix socket, used instead of TCP when given (default None)
+    """
+    if path:
+        reader, writer = await asyncio.open_unix_connection(path)
+    else:
+        reader, writer = await asyncio.open_connection(host, port)
+    try:
+        while True:
+            writer.write(b"\n")
+            await writer.drain()
+            line = await reader.readline()
+            if not line:
+                return
+            yield json.loads(line)
+    finally:
+        writer.close()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Publish lane guidance to local clients as newline-JSON")
+    parser.add_argument("source", help="video file, frame directory, .frames dataset, rtsp:// URL or udp[:port]")
+    parser.add_argument("--host", type=str, default="127.0.0.1", help="TCP address to listen on")
+    parser.add_argument("--port", type=int, default=8765, help="TCP port to listen on")
+    parser.add_argument("--unix", type=str, help="listen on this Unix socket instead of TCP")
+    parser.add_argument("--rate", type=float, default=0, help="maximum frames per second, 0 for every frame")
+    parser.add_argument("--params", type=int, nargs="+", default=list(runner.DETECT_ARGS), help="detect_lines parameters")
+    parser.add_argument("--replay", action="store_true", help="replay a file or directory at its own frame rate like a live stream")
+    parser.add_argument("--preprocess", action="store_true", help="crop before resizing into reused buffers: faster, but finds only 50%% of the lanes with 67%% precision (regression.py)")
+    args = parser.parse_args()
+
+    lane_detection.set_drawing(False) # nothing is drawn for the clients
+    server = GuidanceServer(runner.FrameSource(args.source, args.replay), tuple(args.params), args.rate, preprocess=args.preprocess)
+    try:
+        asyncio.run(server.serve(args.host, args.port, args.unix))
+    except KeyboardInterrupt:
+        pass
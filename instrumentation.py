@@ -0,0 +1,171 @@
+"""Optional low-overhead timing and counters for the detection hot path
+
+Functions decorated with instrument() record their wall time, how many items
+they returned (lines, lanes, ...) and how often they returned nothing. Nothing
+is recorded until enable() is called; while disabled a decorated call costs one
+extra function call and a flag check.
+
+    import instrumentation
+    instrumentation.enable()
+    ... run detection ...
+    print(instrumentation.stats())
+    instrumentation.start_dump('stats.json', interval = 10)
+"""
+import bisect
+import functools
+import json
+import threading
+import time
+
+# upper bounds (ms) of the latency histogram buckets, the last bucket is everything above
+BUCKETS_MS = [0.1, 0.25, 0.5, 1, 2.5, 5, 10, 25, 50, 100, 250, 500, 1000]
+
+_enabled = False
+_lock = threading.Lock()
+_metrics = {}
+_dumper = None
+
+
+class _Metric():
+    __slots__ = ('calls', 'totalTime', 'maxTime', 'histogram', 'items', 'empty')
+
+    def __init__(self):
+        self.calls = 0
+        self.totalTime = 0.0
+        self.maxTime = 0.0
+        self.histogram = [0] * (len(BUCKETS_MS) + 1)
+        self.items = 0
+        self.empty = 0
+
+
+def enable():
+    """Start recording instrumented calls"""
+    global _enabled
+    _enabled = True
+
+def disable():
+    """Stop recording instrumented calls (collected stats are kept)"""
+    global _enabled
+    _enabled = False
+
+def is_enabled():
+    return _enabled
+
+def reset():
+    """Forget all collected stats"""
+    with _lock:
+        _metrics.clear()
+
+
+def record(name, duration, count = None):
+    """Adds one call to a metric
+    args:
+        name (str): metric name
+        duration (float): wall time of the call in seconds
+        count (int): number of items the call produced, None if it doesn't produce items
+    """
+    ms = duration * 1000
+    with _lock:
+        metric = _metrics.get(name)
+        if metric is None:
+            metric = _metrics[name] = _Metric()
+        metric.calls += 1
+        metric.totalTime += ms
+        metric.maxTime = max(metric.maxTime, ms)
+        metric.histogram[bisect.bisect_left(BUCKETS_MS, ms)] += 1
+        if count is not None:
+            metric.items += count
+            if count == 0:
+                metric.empty += 1
+
+
+def instrument(name, count = None):
+    """Decorator that records a function's wall time while instrumentation is enabled
+    args:
+        name (str): metric name
+        count (function): takes the function's result and returns how many items it produced (default None)
+    """
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            if not _enabled:
+                return func(*args, **kwargs)
+            start = time.perf_counter()
+            result = func(*args, **kwargs)
+            duration = time.perf_counter() - start
+            record(name, duration, None if count is None else count(result))
+            return result
+        return wrapper
+    return decorator
+
+
+def _percentile(histogram, calls, fraction):
+    # upper bound of the bucket holding the given fraction of calls
+    target = fraction * calls
+    seen = 0
+    for bound, n in zip(BUCKETS_MS + [float('inf')], histogram):
+        seen += n
+        if seen >= target:
+            return bound
+    return float('inf')
+
+def stats():
+    """Returns a snapshot of all collected stats
+    returns:
+        (dict): metric name -> {"calls", "total_ms", "mean_ms", "max_ms", "p50_ms", "p95_ms", "p99_ms", "histogram", ...}
+            plus "items", "mean_items" and "empty" for metrics that count items.
+            Percentiles are histogram bucket upper bounds.
+    """
+    snapshot = {}
+    with _lock:
+        for name, m in _metrics.items():
+            entry = {
+                "calls": m.calls,
+                "total_ms": m.totalTime,
+                "mean_ms": m.totalTime / m.calls,
+                "max_ms": m.maxTime,
+                "p50_ms": _percentile(m.histogram, m.calls, 0.5),
+                "p95_ms": _percentile(m.histogram, m.calls, 0.95),
+                "p99_ms": _percentile(m.histogram, m.calls, 0.99),
+                "histogram": dict(zip([f"<={b}" for b in BUCKETS_MS] + [f">{BUCKETS_MS[-1]}"], m.histogram)),
+            }
+            if m.items or m.empty:
+                entry["items"] = m.items
+                entry["mean_items"] = m.items / m.calls
+                entry["empty"] = m.empty
+            snapshot[name] = entry
+    return snapshot
+
+
+def dump(path):
+    """Writes stats() to a JSON file"""
+    with open(path, 'w') as f:
+        json.dump({"time": time.time(), "stats": stats()}, f, indent=2)
+
+
+def start_dump(path, interval = 10.0):
+    """Writes stats to a JSON file every interval seconds on a background thread
+    args:
+        path (str): JSON file to (over)write
+        interval (float): seconds between dumps (default 10)
+    """
+    global _dumper
+    stop_dump()
+    stop = threading.Event()
+
+    def run():
+        while not stop.wait(interval):
+            dump(path)
+
+    thread = threading.Thread(target = run, daemon = True)
+    thread.start()
+    _dumper = (thread, stop)
+
+def stop_dump():
+    """Stops the periodic dump started by start_dump"""
+    global _dumper
+    if _dumper is not None:
+        thread, stop = _dumper
+        stop.set()
+        thread.join()
+        _dumper = None
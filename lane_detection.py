@@ -1,26 +1,203 @@
 import cv2
 import numpy as np
-import matplotlib.pyplot as plt
+import instrumentation
 
-def detect_lines(img, threshold1 = 50, threshold2 = 150, apertureSize = 3, minLineLength = 100, maxLineGap = 10):
+class FrameContext():
+    """Decodes a frame once and lazily caches the images derived from it.
+    Every function in lane_detection and lane_following accepts a FrameContext wherever it takes an image.
+    args:
+        img (image path or np.ndarray): frame to wrap
+    """
+    __slots__ = ('image', 'path', '_gray', '_blurred', '_binary', '_edges', '_lines', '_slopesIntercepts')
+
+    def __init__(self, img):
+        self.path = None
+        if not isinstance(img, np.ndarray):
+            self.path = img
+            img = cv2.imread(img)
+        self.image = img
+        self._gray = None
+        self._blurred = {}
+        self._binary = {}
+        self._edges = {}
+        self._lines = None
+        self._slopesIntercepts = None
+
+    @property
+    def shape(self):
+        return self.image.shape
+
+    def gray(self):
+        """Returns the grayscale frame"""
+        if self._gray is None:
+            self._gray = cv2.cvtColor(self.image, cv2.COLOR_BGR2GRAY)
+        return self._gray
+
+    def blurred(self, blurSize = 10):
+        """Returns the box blurred grayscale frame"""
+        if blurSize not in self._blurred:
+            self._blurred[blurSize] = cv2.blur(self.gray(), [blurSize, blurSize])
+        return self._blurred[blurSize]
+
+    def binary(self, blurSize = 10):
+        """Returns (Otsu threshold, binary image) of the blurred frame"""
+        if blurSize not in self._binary:
+            self._binary[blurSize] = cv2.threshold(self.blurred(blurSize), 128, 255, cv2.THRESH_BINARY | cv2.THRESH_OTSU)
+        return self._binary[blurSize]
+
+    def edges(self, threshold1 = 50, threshold2 = 150, apertureSize = 3, blurSize = 10):
+        """Returns the Canny edges of the binary frame"""
+        key = (threshold1, threshold2, apertureSize, blurSize)
+        if key not in self._edges:
+            self._edges[key] = cv2.Canny(self.binary(blurSize)[1], threshold1, threshold2, apertureSize=apertureSize)
+        return self._edges[key]
+
+    def slopes_intercepts(self, lines):
+        """Returns get_slopes_intercepts of lines, computed once for the most recent lines object"""
+        if self._lines is not lines:
+            self._slopesIntercepts = get_slopes_intercepts(self.image, lines)
+            self._lines = lines
+        return self._slopesIntercepts
+
+class Preprocessor():
+    """Crops, resizes and grayscales frames of one fixed size into buffers allocated once.
+    The part of the frame that is kept is cropped before resizing, so the discarded top half is never resized.
+    Blur, Otsu threshold and Canny are only run when detection asks for them (pyramid levels never do),
+    for the detectArgs given they also write into preallocated buffers through dst=.
+    process() returns the same FrameContext every time; it and all of its images are overwritten by the next frame,
+    copy whatever has to outlive one. Cropping first shifts the resampling grid, and Hough reacts to that far more than
+    the pixels change: against resizing the whole frame first, regression.py measures 50% lane recall and 67% precision
+    (lanes missed on half the frames that have one, and phantom lanes), so it is not a drop-in for steering.
+    args:
+        inputSize (tuple): (width, height) of incoming frames
+        outputSize (tuple): (width, height) the full frame is resized to before keeping its bottom half (default (1912, 1069), like lane_following.process_frame)
+        detectArgs (tuple): threshold1, threshold2, apertureSize, minLineLength, maxLineGap[, blurSize] whose filtered images get buffers (default (50, 70, 3, 200, 10))
+    """
+
+    def __init__(self, inputSize, outputSize = (1912, 1069), detectArgs = (50, 70, 3, 200, 10)):
+        width, height = outputSize
+        top = int(height/2)
+        self.inputSize = tuple(inputSize)
+        self.sourceTop = round(top * inputSize[1] / height) # first kept row of the incoming frame
+        self.size = (width, height - top)
+        self.threshold1, self.threshold2, self.apertureSize = detectArgs[:3]
+        self.blurSize = detectArgs[5] if len(detectArgs) > 5 else 10
+        shape = (height - top, width)
+        self.image = np.empty(shape + (3,), dtype=np.uint8)
+        self.grayImage = np.empty(shape, dtype=np.uint8)
+        self.blurredImage = np.empty(shape, dtype=np.uint8)
+        self.binaryImage = np.empty(shape, dtype=np.uint8)
+        self.edgesImage = np.empty(shape, dtype=np.uint8)
+        self.context = _BufferedContext(self)
+
+    def process(self, frame):
+        """Crops, resizes and grayscales one frame into the buffers
+        args:
+            frame (np.ndarray): raw frame of inputSize
+        returns:
+            (FrameContext): context of the resized crop, its other images are filtered on first use
+        """
+        if (frame.shape[1], frame.shape[0]) != self.inputSize:
+            raise ValueError(f"Preprocessor expects {self.inputSize[0]}x{self.inputSize[1]} frames, got {frame.shape[1]}x{frame.shape[0]}")
+        cv2.resize(frame[self.sourceTop :], self.size, dst=self.image)
+        cv2.cvtColor(self.image, cv2.COLOR_BGR2GRAY, dst=self.grayImage)
+
+        # forget the previous frame's filtered images
+        context = self.context
+        context._gray = self.grayImage
+        context._blurred = {}
+        context._binary = {}
+        context._edges = {}
+        context._lines = context._slopesIntercepts = None
+        return context
+
+class _BufferedContext(FrameContext):
+    # FrameContext whose filtered images for the Preprocessor's own detectArgs go into its buffers
+    __slots__ = ('_preprocessor',)
+
+    def __init__(self, preprocessor):
+        FrameContext.__init__(self, preprocessor.image)
+        self._preprocessor = preprocessor
+
+    def blurred(self, blurSize = 10):
+        pre = self._preprocessor
+        if blurSize != pre.blurSize or blurSize in self._blurred:
+            return FrameContext.blurred(self, blurSize)
+        self._blurred[blurSize] = cv2.blur(self.gray(), [blurSize, blurSize], dst=pre.blurredImage)
+        return pre.blurredImage
+
+    def binary(self, blurSize = 10):
+        pre = self._preprocessor
+        if blurSize != pre.blurSize or blurSize in self._binary:
+            return FrameContext.binary(self, blurSize)
+        thresh, _ = cv2.threshold(self.blurred(blurSize), 128, 255, cv2.THRESH_BINARY | cv2.THRESH_OTSU, dst=pre.binaryImage)
+        self._binary[blurSize] = (thresh, pre.binaryImage)
+        return self._binary[blurSize]
+
+    def edges(self, threshold1 = 50, threshold2 = 150, apertureSize = 3, blurSize = 10):
+        pre = self._preprocessor
+        key = (threshold1, threshold2, apertureSize, blurSize)
+        if key != (pre.threshold1, pre.threshold2, pre.apertureSize, pre.blurSize) or key in self._edges:
+            return FrameContext.edges(self, threshold1, threshold2, apertureSize, blurSize)
+        self._edges[key] = cv2.Canny(self.binary(blurSize)[1], threshold1, threshold2, edges=pre.edgesImage, apertureSize=apertureSize)
+        return pre.edgesImage
+
+def load_image(img):
+    """Returns the np.ndarray behind an image path, np.ndarray or FrameContext"""
+    if isinstance(img, FrameContext):
+        return img.image
+    if not isinstance(img, np.ndarray):
+        return cv2.imread(img)
+    return img
+
+_drawing = True
+
+def set_drawing(enabled):
+    """Turns all overlay drawing on or off: detect_lines' own green lines, draw_lines, draw_lanes and lane_following.draw_lane_center.
+    Turn it off when only the steering output is needed.
+    args:
+        enabled (bool): draw overlays
+    """
+    global _drawing
+    _drawing = bool(enabled)
+
+def drawing_enabled():
+    return _drawing
+
+@instrumentation.instrument('detect_lines', count=len)
+def detect_lines(img, threshold1 = 50, threshold2 = 150, apertureSize = 3, minLineLength = 100, maxLineGap = 10, blurSize = 10, level = 0, refine = False, asArray = False, draw = None):
     """Detects if lines are present in an image (pool).
     args:
-        img (image path or np.ndarray): image of pool to detect lines from
+        img (image path, np.ndarray or FrameContext): image of pool to detect lines from
         threshold1 (int): lower threshold to detect lines (default 50)
         threshold2 (int): upper threshold to detect lines (default 150)
         apertureSize (odd int): amount of details cv2 will be taking (default 3)
         minLineLength (int): the minimum line length of lines detected (default 100)
         maxLineGap (int): the maximum line gap of lines detected (default 10)
+        blurSize (int): size of the box blur applied before thresholding (default 10)
+        level (int): image pyramid level to detect on, each level halves the resolution (default 0, full resolution)
+        refine (bool): refine endpoints at full resolution when level > 0 (default False)
+        asArray (bool): return an Nx4 int32 array instead of a list (default False)
+        draw (bool): draw the lines on img, None follows set_drawing (default None)
     returns:
-        (list): list of points [[x1, y2, x2, y2], ...] that correspond to detected lines
+        (list or np.ndarray): list of points [[x1, y2, x2, y2], ...] that correspond to detected lines
     """
-    if not isinstance(img, np.ndarray):
-        img = cv2.imread(img)
-    grayimg = cv2.cvtColor(img, cv2.COLOR_BGR2GRAY) # convert to grayscale
-    # grayCon = cv2.addWeighted(gray, 2, gray, 0, 0)
-    imgblur = cv2.blur(grayimg, [10, 10])
-    (thresh, im_bw) = cv2.threshold(imgblur, 128, 255, cv2.THRESH_BINARY | cv2.THRESH_OTSU)
-    edges = cv2.Canny(im_bw, threshold1, threshold2, apertureSize=apertureSize) # detect edges
+    draw = _drawing if draw is None else draw
+    frame = img if isinstance(img, FrameContext) else None
+    img = load_image(img)
+    if level > 0:
+        lineList = detect_lines_pyramid(frame or img, threshold1, threshold2, apertureSize, minLineLength, maxLineGap, blurSize, level, refine)
+        for x1, y1, x2, y2 in (lineList if draw else []):
+            cv2.line(img, (x1, y1), (x2, y2), (0, 255, 0), 2)
+        return lines_to_array(lineList) if asArray else lineList
+    if frame is not None:
+        edges = frame.edges(threshold1, threshold2, apertureSize, blurSize)
+    else:
+        grayimg = cv2.cvtColor(img, cv2.COLOR_BGR2GRAY) # convert to grayscale
+        # grayCon = cv2.addWeighted(gray, 2, gray, 0, 0)
+        imgblur = cv2.blur(grayimg, [blurSize, blurSize])
+        (thresh, im_bw) = cv2.threshold(imgblur, 128, 255, cv2.THRESH_BINARY | cv2.THRESH_OTSU)
+        edges = cv2.Canny(im_bw, threshold1, threshold2, apertureSize=apertureSize) # detect edges
     lines = cv2.HoughLinesP(
                     edges,
                     1,
@@ -30,102 +207,326 @@ def detect_lines(img, threshold1 = 50, threshold2 = 150, apertureSize = 3, minLi
                     maxLineGap=maxLineGap,
             ) # detect lines
 
+    if asArray:
+        lineArray = lines_to_array(lines if lines is not None else [])
+        for x1, y1, x2, y2 in (lineArray if draw else []):
+            cv2.line(img, (int(x1), int(y1)), (int(x2), int(y2)), (0, 255, 0), 2)
+        return lineArray
+
     lineList = []
     if lines is not None:
         for line in lines:
             x1, y1, x2, y2 = line[0]
             linexy = [x1, y1, x2, y2]
-            cv2.line(img, (x1, y1), (x2, y2), (0, 255, 0), 2)
+            if draw:
+                cv2.line(img, (x1, y1), (x2, y2), (0, 255, 0), 2)
             lineList.append(linexy)
     return lineList
 
-def draw_lines(img, lines, color = (0, 255, 0)):
+def detect_lines_pyramid(img, threshold1 = 50, threshold2 = 150, apertureSize = 3, minLineLength = 100, maxLineGap = 10, blurSize = 10, level = 1, refine = False):
+    """Detects lines on a downscaled pyramid level of an image and returns them in the image's own coordinates.
+    The blur size, Hough vote threshold, minLineLength and maxLineGap are scaled down with the image.
+    args:
+        img (image path, np.ndarray or FrameContext): image of pool to detect lines from
+        threshold1 (int): lower threshold to detect lines (default 50)
+        threshold2 (int): upper threshold to detect lines (default 150)
+        apertureSize (odd int): amount of details cv2 will be taking (default 3)
+        minLineLength (int): the minimum line length of lines detected, in full resolution pixels (default 100)
+        maxLineGap (int): the maximum line gap of lines detected, in full resolution pixels (default 10)
+        blurSize (int): size of the box blur at full resolution (default 10)
+        level (int): pyramid level, each level halves the resolution (default 1)
+        refine (bool): fit each line to the full resolution edges around it (default False)
+    returns:
+        (list): list of points [[x1, y2, x2, y2], ...] that correspond to detected lines
+    """
+    if isinstance(img, FrameContext):
+        grayimg = img.gray()
+    else:
+        grayimg = cv2.cvtColor(load_image(img), cv2.COLOR_BGR2GRAY)
+    small = grayimg
+    for _ in range(level):
+        small = cv2.pyrDown(small)
+    scale = grayimg.shape[1] / small.shape[1]
+    smallBlur = max(1, round(blurSize / scale))
+    imgblur = cv2.blur(small, [smallBlur, smallBlur])
+    (thresh, im_bw) = cv2.threshold(imgblur, 128, 255, cv2.THRESH_BINARY | cv2.THRESH_OTSU)
+    edges = cv2.Canny(im_bw, threshold1, threshold2, apertureSize=apertureSize)
+    lines = cv2.HoughLinesP(
+                    edges,
+                    1,
+                    np.pi/180,
+                    max(1, round(100 / scale)),
+                    minLineLength=minLineLength / scale,
+                    maxLineGap=maxLineGap / scale,
+            )
+
+    lineList = []
+    if lines is not None:
+        height, width = grayimg.shape
+        for line in lines:
+            x1, y1, x2, y2 = [int(min(round(v * scale), limit - 1)) for v, limit in zip(line[0], (width, height, width, height))]
+            if refine:
+                x1, y1, x2, y2 = refine_line(grayimg, [x1, y1, x2, y2], thresh, scale, threshold1, threshold2, apertureSize, blurSize)
+            lineList.append([x1, y1, x2, y2])
+    return lineList
+
+def refine_line(grayimg, line, thresh, scale, threshold1 = 50, threshold2 = 150, apertureSize = 3, blurSize = 10):
+    """Fits a line found at low resolution to the full resolution edge pixels near it
+    args:
+        grayimg (np.ndarray): full resolution grayscale image
+        line (list): [x1, y1, x2, y2] in full resolution coordinates
+        thresh (float): binary threshold found at low resolution
+        scale (float): how many full resolution pixels one low resolution pixel covers
+        threshold1, threshold2, apertureSize: Canny parameters
+        blurSize (int): size of the box blur (default 10)
+    returns:
+        (list): refined [x1, y1, x2, y2], the original line if there aren't enough edges near it
+    """
+    x1, y1, x2, y2 = line
+    height, width = grayimg.shape
+    pad = int(2 * scale) + 5
+    left, top = max(0, min(x1, x2) - pad), max(0, min(y1, y2) - pad)
+    right, bottom = min(width, max(x1, x2) + pad + 1), min(height, max(y1, y2) + pad + 1)
+    roi = cv2.blur(grayimg[top:bottom, left:right], [blurSize, blurSize])
+    (_, im_bw) = cv2.threshold(roi, thresh, 255, cv2.THRESH_BINARY)
+    edges = cv2.Canny(im_bw, threshold1, threshold2, apertureSize=apertureSize)
+    ys, xs = np.nonzero(edges)
+    if len(xs) < 2:
+        return line
+
+    # keep the edge pixels close to the coarse line
+    direction = np.array([x2 - x1, y2 - y1], dtype=np.float64)
+    length = np.hypot(*direction)
+    if length == 0:
+        return line
+    direction /= length
+    px, py = xs + left - x1, ys + top - y1
+    near = np.abs(px * direction[1] - py * direction[0]) <= scale * 1.5
+    if np.count_nonzero(near) < 2:
+        return line
+    points = np.stack((xs[near] + left, ys[near] + top), axis=1).astype(np.float32)
+    vx, vy, cx, cy = cv2.fitLine(points, cv2.DIST_L2, 0, 0.01, 0.01).ravel()
+
+    # move the coarse endpoints onto the fitted line
+    refined = []
+    for x, y in ((x1, y1), (x2, y2)):
+        t = (x - cx) * vx + (y - cy) * vy
+        refined += [int(round(min(max(cx + t * vx, 0), width - 1))), int(round(min(max(cy + t * vy, 0), height - 1)))]
+    return refined
+
+@instrumentation.instrument('detect_lines_ransac', count=len)
+def detect_lines_ransac(img, threshold1 = 50, threshold2 = 150, apertureSize = 3, minLineLength = 100, maxLineGap = 10, blurSize = 10,
+                        maxLines = 6, iterations = 64, inlierDistance = 2.0, minInliers = 100, maxPoints = 1500, seedLines = None,
+                        seedDistance = 8.0, randomSeed = 0, draw = None):
+    """Detects lines by fitting them straight to the edge pixels with RANSAC instead of HoughLinesP.
+    Only faster when seeded: on the bundled 1912x535 crops a full search takes ~5.2 ms p50 against ~3.3 ms for
+    HoughLinesP, seeded with the previous frame's lines (lane_tracking.LaneTracker(engine='ransac')) it takes
+    ~2.7 ms (benchmark.py --engines). It does not reproduce Hough: unseeded it finds every Hough line plus lines
+    Hough breaks up, so lane presence agrees on only 7 of 12 frames, seeded on 5 of 12 (centers agree where both find a lane).
+    args:
+        img (image path, np.ndarray or FrameContext): image of pool to detect lines from
+        threshold1 (int): lower threshold to detect lines (default 50)
+        threshold2 (int): upper threshold to detect lines (default 150)
+        apertureSize (odd int): amount of details cv2 will be taking (default 3)
+        minLineLength (int): the minimum line length of lines detected (default 100)
+        maxLineGap (int): the maximum line gap of lines detected (default 10)
+        blurSize (int): size of the box blur applied before thresholding (default 10)
+        maxLines (int): the maximum number of lines to fit (default 6)
+        iterations (int): random line hypotheses tried per line (default 64)
+        inlierDistance (float): how far in pixels an edge pixel may be from a line to belong to it (default 2.0)
+        minInliers (int): the minimum number of edge pixels a line needs, counted before subsampling like HoughLinesP's votes (default 100)
+        maxPoints (int): edge pixels are randomly subsampled down to this many (default 1500)
+        seedLines (list): lines found in the previous frame, each is refit to the edge pixels near it first and the
+            random search only runs when fewer than two of them (a lane) are still there (default None)
+        seedDistance (float): how far in pixels an edge pixel may be from a seed line to be refit to it (default 8.0)
+        randomSeed (int): seed of the random sampling, for repeatable results (default 0)
+        draw (bool): draw the lines on img, None follows set_drawing (default None)
+    returns:
+        (list): list of points [[x1, y2, x2, y2], ...] that correspond to detected lines
+    """
+    draw = _drawing if draw is None else draw
+    frame = img if isinstance(img, FrameContext) else FrameContext(load_image(img))
+    img = frame.image
+    edges = frame.edges(threshold1, threshold2, apertureSize, blurSize)
+    rng = np.random.default_rng(randomSeed)
+
+    found = cv2.findNonZero(edges)
+    points = np.empty((0, 2), dtype=np.float32) if found is None else found.reshape(-1, 2).astype(np.float32)
+    sampling = 1.0
+    if len(points) > maxPoints:
+        sampling = len(points) / maxPoints
+        points = points[rng.choice(len(points), maxPoints, replace=False)]
+    # subsampling leaves gaps between edge pixels, allow for them
+    maxGap = max(maxLineGap, 2 * inlierDistance) * sampling
+
+    def fit(near):
+        # least squares fit on the pixels in near, then recollect inliers around the fitted line
+        # returns the inlier mask, and the line (None when its longest run is shorter than minLineLength)
+        vx, vy, cx, cy = cv2.fitLine(points[near], cv2.DIST_L2, 0, 0.01, 0.01).ravel()
+        refined = np.abs((points[:, 0] - cx) * vy - (points[:, 1] - cy) * vx) <= inlierDistance
+        inliers = refined if np.count_nonzero(refined) * sampling >= minInliers else near
+        onLine = points[inliers]
+        # keep the longest run of inliers without a gap larger than maxGap, like HoughLinesP's maxLineGap
+        t = np.sort((onLine[:, 0] - cx) * vx + (onLine[:, 1] - cy) * vy)
+        breaks = np.flatnonzero(np.diff(t) > maxGap)
+        runStarts = np.concatenate(([0], breaks + 1))
+        runEnds = np.concatenate((breaks, [len(t) - 1]))
+        longest = np.argmax(t[runEnds] - t[runStarts])
+        tMin, tMax = t[runStarts[longest]], t[runEnds[longest]]
+        if tMax - tMin < minLineLength:
+            return inliers, None
+        return inliers, [int(round(v)) for v in (cx + tMin * vx, cy + tMin * vy, cx + tMax * vx, cy + tMax * vy)]
+
+    lineList = []
+    # tracking: refit each of the previous frame's lines to the edge pixels around it, no hypotheses needed
+    for x1, y1, x2, y2 in lines_to_array(seedLines if seedLines is not None else [])[:maxLines].astype(np.float32):
+        length = np.hypot(x2 - x1, y2 - y1)
+        if length == 0 or len(points) == 0:
+            continue
+        near = np.abs((points[:, 0] - x1) * (y2 - y1) - (points[:, 1] - y1) * (x2 - x1)) <= seedDistance * length
+        if np.count_nonzero(near) * sampling < max(2, minInliers):
+            continue
+        inliers, line = fit(near)
+        if line is not None:
+            points = points[~inliers]
+            lineList.append(line)
+    if len(lineList) >= 2:
+        points = points[:0] # the lane is still there, skip the random search
+
+    while len(lineList) < maxLines and len(points) * sampling >= max(2, minInliers):
+        # hypotheses: lines through random pairs of edge pixels
+        pairs = rng.integers(0, len(points), size=(iterations, 2))
+        starts, ends = points[pairs[:, 0]], points[pairs[:, 1]]
+        direction = ends - starts
+        length = np.hypot(direction[:, 0], direction[:, 1])
+        valid = length > 0
+        normals = np.stack((-direction[valid, 1], direction[valid, 0]), axis=1) / length[valid, None]
+        offsets = np.einsum('ij,ij->i', normals, starts[valid])
+
+        # score every hypothesis at once on a random subset of the points
+        scorePoints = points if len(points) <= 1000 else points[rng.choice(len(points), 1000, replace=False)]
+        counts = np.count_nonzero(np.abs(scorePoints @ normals.T - offsets) <= inlierDistance, axis=0)
+        if len(counts) == 0:
+            break
+        best = np.argmax(counts)
+        inliers = np.abs(points @ normals[best] - offsets[best]) <= inlierDistance
+        if np.count_nonzero(inliers) * sampling < minInliers:
+            break
+        inliers, line = fit(inliers)
+        points = points[~inliers]
+        if line is not None:
+            lineList.append(line)
+
+    for x1, y1, x2, y2 in (lineList if draw else []):
+        cv2.line(img, (x1, y1), (x2, y2), (0, 255, 0), 2)
+    return lineList
+
+def draw_lines(img, lines, color = (0, 255, 0), thickness = 3):
     """Returns an image with specified lines drawn on
     args:
-        img (image path or np.ndarray): image that lines are drawn on
+        img (image path, np.ndarray or FrameContext): image that lines are drawn on
         lines (list): list of points [[x1, y2, x2, y2], ...] of the lines being drawn
         color (tuple): (x, x, x)
+        thickness (int): line thickness (default 3)
     returns:
         (np.ndarray): image with lines drawn on
     """
-    if not isinstance(img, np.ndarray):
-        img = cv2.imread(img)
-    for line in lines:
-        cv2.line(img, (line[0], line[1]), (line[2], line[3]), color, 3) 
+    img = load_image(img)
+    for line in (lines if _drawing else []):
+        cv2.line(img, (int(line[0]), int(line[1])), (int(line[2]), int(line[3])), color, thickness)
     return img
 
+def lines_to_array(lines):
+    """Converts lines into an Nx4 int32 segment array
+    args:
+        lines (list or np.ndarray): list of points [[x1, y2, x2, y2], ...] or an array of shape (N, 4) / (N, 1, 4)
+    returns:
+        (np.ndarray): Nx4 int32 array of segments, lines_to_array(lines).tolist() gives back the list format
+    """
+    if len(lines) == 0:
+        return np.empty((0, 4), dtype=np.int32)
+    return np.asarray(lines, dtype=np.int32).reshape(-1, 4)
+
+def lanes_to_array(lanes):
+    """Converts lanes into an (M, 2, 4) int32 array
+    args:
+        lanes (list or np.ndarray): list of lanes [[[x, x, x, x], [x, x, x, x]], ...]
+    returns:
+        (np.ndarray): (M, 2, 4) int32 array of lanes, lanes_to_array(lanes).tolist() gives back the list format
+    """
+    if len(lanes) == 0:
+        return np.empty((0, 2, 4), dtype=np.int32)
+    return np.asarray(lanes, dtype=np.int32).reshape(-1, 2, 4)
+
 def get_slopes_intercepts(img, lines):
     """Returns slopes and bottom x-intercepts of given lines in an image
     args: 
-        img (image path or np.ndarray): image that lines reside in
-        lines (list): list of points [[x1, y2, x2, y2], ...] of the lines
+        img (image path, np.ndarray or FrameContext): image that lines reside in
+        lines (list or np.ndarray): list of points [[x1, y2, x2, y2], ...] or Nx4 array of the lines
     returns:
-        (list, list): 2 lists of the slopes and intercepts of the specified lines
+        (np.ndarray, np.ndarray): 2 arrays of the slopes and intercepts of the specified lines
         """
-    if not isinstance(img, np.ndarray):
-        img = cv2.imread(img)
-    slopes = []
-    intercepts = []
+    if isinstance(img, FrameContext):
+        return img.slopes_intercepts(lines)
+    img = load_image(img)
     height = img.shape[0]
-    for line in lines:
-        if line[0] == line[2]:
-            line[0] += 0.000000001
-        slope = (line[1] - line[3]) / (line[0] - line[2])
-        slopes.append(slope)
-        if slope == 0:
-            slope = 0.0000000001
-        intercepts.append((height-line[1])/slope + line[0])
+    segments = np.asarray(lines, dtype=np.float64).reshape(-1, 4)
+    x1, y1, x2, y2 = segments.T
+    dx = x1 - x2
+    dx[dx == 0] = 0.000000001 # vertical lines
+    slopes = (y1 - y2) / dx
+    safeSlopes = np.where(slopes == 0, 0.0000000001, slopes) # horizontal lines
+    intercepts = (height - y1) / safeSlopes + x1
     return slopes, intercepts
 
+@instrumentation.instrument('detect_lanes', count=len)
 def detect_lanes(imageInput, lines):
     """Detects lanes from given lines and an image.
     args:
-        imageInput (image path or np.ndarray): image that lines originate from
-        lines (list): list of points [[x1, y2, x2, y2], ...] of the lines
+        imageInput (image path, np.ndarray or FrameContext): image that lines originate from
+        lines (list or np.ndarray): list of points [[x1, y2, x2, y2], ...] or Nx4 array of the lines
     return:
-        (list): list of possible lanes, each lane containing 2 lines with points - [[[x, x, x, x], [x, x, x, x]], ...]
+        (list or np.ndarray): list of possible lanes, each lane containing 2 lines with points - [[[x, x, x, x], [x, x, x, x]], ...]
+            (an (M, 2, 4) int32 array if lines was given as an array)
     """
-    if not isinstance(imageInput, np.ndarray):
+    if not isinstance(imageInput, (np.ndarray, FrameContext)):
         imageInput = cv2.imread(imageInput)
-    img = cv2.cvtColor(imageInput, cv2.COLOR_BGR2GRAY)
-    slopes, intercepts = get_slopes_intercepts(img, lines)
-    lineDict = dict(sorted(zip(intercepts, slopes)))
-    height = img.shape[0]
-    possibleLanes = []
-
-    # finding lines with similar slopes and intercepts
-    for i in range(1, len(lineDict)):
-        # checks if slopes and intercepts are similar
-        intercept1, intercept2 = list(lineDict)[i-1], list(lineDict)[i]
-        slope1, slope2 = list(lineDict.values())[i-1], list(lineDict.values())[i]
-        if abs(intercept1 - intercept2) < 400 and abs(intercept1 - intercept2) > 50 and abs(slope1 - slope2) < 4 and abs(slope1 - slope2) > 0.03:
-            # # find the fuckin in between line darkness
-            # centerM2 = int((intercept1 + intercept2) / 2 - 2)
-            # averageDark = 0
-            # for pixel in range(centerM2, (centerM2 + 5)):
-            #     colorValue = img[(height-2)][pixel]
-            #     averageDark += colorValue
-            # if (averageDark/5) <= 75:
-            # finds indices of lines list that correspond to lanes
-            index1, index2 = intercepts.index(list(lineDict)[i-1]), intercepts.index(list(lineDict)[i])
-            line1, line2 = lines[index1], lines[index2]
-            possibleLanes.append([line1, line2])
-    return possibleLanes
+    segments = lines_to_array(lines)
+    slopes, intercepts = get_slopes_intercepts(imageInput, lines)
+
+    # sort by intercept (then slope), keeping one line per unique intercept
+    order = np.lexsort((slopes, intercepts))
+    sortedInters = intercepts[order]
+    newGroup = np.ones(len(order), dtype=bool)
+    newGroup[1:] = sortedInters[1:] != sortedInters[:-1]
+    starts = np.flatnonzero(newGroup)
+    ends = np.append(starts[1:] - 1, len(order) - 1)[:len(starts)]
+    uniqueInters = sortedInters[starts]
+    uniqueSlopes = slopes[order][ends] # largest slope of each intercept
+    firstIndex = np.minimum.reduceat(order, starts) if len(order) else order # first line with each intercept
+
+    # finding neighbouring lines with similar slopes and intercepts
+    interDiff = np.abs(np.diff(uniqueInters))
+    slopeDiff = np.abs(np.diff(uniqueSlopes))
+    isLane = (interDiff < 400) & (interDiff > 50) & (slopeDiff < 4) & (slopeDiff > 0.03)
+    pairs = np.flatnonzero(isLane)
+    lanes = np.stack((segments[firstIndex[pairs]], segments[firstIndex[pairs + 1]]), axis=1)
+
+    if isinstance(lines, np.ndarray):
+        return lanes
+    return [[lines[firstIndex[i]], lines[firstIndex[i + 1]]] for i in pairs]
 
 
 def draw_lanes(img, lanes):
     """draws specified lanes on a given image.
     args:
-        img (image path or np.ndarray): image that lanes are drawn on
+        img (image path, np.ndarray or FrameContext): image that lanes are drawn on
         lanes (list): list of possible lanes, each lane containing 2 lines with points - [[[x, x, x, x], [x, x, x, x]], ...]
     return:
         (np.ndarray): image with specified lanes drawn on
         """
-    if not isinstance(img, np.ndarray):
-        image = cv2.imread(img)
-    else:
-        image = img
-    if lanes != []:
+    image = load_image(img)
+    if len(lanes) != 0 and _drawing:
         for lane in lanes:
             for line in lane:
                 cv2.line(image, (line[0], line[1]), (line[2], line[3]), (0, 255, 255), 4)
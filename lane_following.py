@@ -1,28 +1,79 @@
+import glob
+import itertools
+import os
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+
 import cv2
 import numpy as np
-import matplotlib.pyplot as plt
+import frame_dataset
+import instrumentation
 import lane_detection
+import video_pipeline
+
+
+
+# structured dtype for storing many LaneCenter records in one array
+LANE_CENTER_DTYPE = np.dtype([('slope', np.float64), ('intercept', np.float64), ('interceptY', np.float64)])
+
+class LaneCenter():
+    """Center line of a lane, indexable like the old [centerSlope, centerIntercept, centerInterceptY] list
+    args:
+        slope (float): slope of the center line
+        intercept (float): x where the center line meets the bottom of the image
+        interceptY (float): y intercept of the center line
+    """
+    __slots__ = ('slope', 'intercept', 'interceptY')
+
+    def __init__(self, slope, intercept, interceptY):
+        self.slope = float(slope)
+        self.intercept = float(intercept)
+        self.interceptY = float(interceptY)
 
+    def __getitem__(self, index):
+        return self.tolist()[index]
 
+    def __iter__(self):
+        return iter(self.tolist())
 
+    def __len__(self):
+        return 3
+
+    def __eq__(self, other):
+        if not isinstance(other, (LaneCenter, list, tuple)):
+            return NotImplemented
+        return list(self) == list(other)
+
+    def __repr__(self):
+        return f"LaneCenter(slope={self.slope}, intercept={self.intercept}, interceptY={self.interceptY})"
+
+    def tolist(self):
+        """Returns [centerSlope, centerIntercept, centerInterceptY]"""
+        return [self.slope, self.intercept, self.interceptY]
+
+    def to_record(self):
+        """Returns the center as a LANE_CENTER_DTYPE record"""
+        return np.array((self.slope, self.intercept, self.interceptY), dtype=LANE_CENTER_DTYPE)
+
+@instrumentation.instrument('get_lane_center')
 def get_lane_center(img, lanes):
     """Find the center of the lane closest to the middle of a list of given lanes
     args: 
-        img (image path or np.ndarray): img that lanes come from
-        lanes (list): list of lanes [[[x, x, x, x], [x, x, x, x]], ...]
+        img (image path, np.ndarray or FrameContext): img that lanes come from
+        lanes (list or np.ndarray): list of lanes [[[x, x, x, x], [x, x, x, x]], ...] or an (M, 2, 4) array
     return: 
-        (list): [centerSlope, centerIntercept]
+        (LaneCenter): [centerSlope, centerIntercept, centerInterceptY]
         """
     
-    if not isinstance(img, np.ndarray):
-        img = cv2.imread(img)
+    img = lane_detection.load_image(img)
     # find slopes and intercepts of all lines in the lanes
     cenSlopes = []
     cenInters = []
     cenIntersy = []
     if lanes is not None:
-        for lane in lanes:
-            slope, intercept = lane_detection.get_slopes_intercepts(img, lane)
+        slopes, intercepts = lane_detection.get_slopes_intercepts(img, np.reshape(lanes, (-1, 4)))
+        for i, lane in enumerate(lanes):
+            slope, intercept = slopes[2*i : 2*i+2], intercepts[2*i : 2*i+2]
             cenSl = 1/((1/slope[0] + 1/slope[1])/2) # center slope float
             cenInt = (intercept[0] + intercept[1])/2 # center int float
             cenInty = ((lane[0][1]-lane[0][0]*slope[0])+(lane[1][1]-lane[1][0]*slope[1]))/2
@@ -40,42 +91,90 @@ def get_lane_center(img, lanes):
 
             # cenInter = sorted(cenInters, key=lambda x: abs(img[1]/2 - x))[0] # center slope that is closest to the center (but I don't think this works) 
         index = cenInters.index(cenInter)
-        slInters = [cenSlopes[index], cenInters[index], cenIntersy[index]]
+        slInters = LaneCenter(cenSlopes[index], cenInters[index], cenIntersy[index])
     return slInters
 
 
 
-def videoDetection(vid):
-    output_video = cv2.VideoWriter('output_video.avi', cv2.VideoWriter_fourcc(*'XVID'), 30, (1912, 535))
+def process_frame(frame, detectArgs = (50, 70, 3, 200, 10), drawCenter = True, tracker = None, gate = None):
+    """Resizes a video frame, keeps its bottom half and draws the detected lanes (and lane center) on it
+    args:
+        frame (np.ndarray): raw video frame
+        detectArgs (tuple): threshold1, threshold2, apertureSize, minLineLength, maxLineGap passed to detect_lines
+        drawCenter (bool): also draw the center of the lane closest to the middle (default True)
+        tracker (lane_tracking.LaneTracker): search near the lane tracked over previous frames instead of the whole frame (default None)
+        gate (motion_gate.MotionGate): reuse the previous frame's results when the frame barely changed (default None)
+    return:
+        (np.ndarray): 1912x535 frame with lanes drawn on
+    """
+    resized = (cv2.resize(frame, (1912, 1069)))
+    h = resized.shape[0]
+    w = resized.shape[1]
+    againResized = resized[int(h/2) : h, 0 : w]
+    frameContext = lane_detection.FrameContext(againResized)
+
+    previous = gate.reuse(againResized) if gate is not None else None
+    if previous is not None:
+        lines, lanes, slInt = previous
+        lane_detection.draw_lines(againResized, lines, thickness = 2)
+    else:
+        if tracker is not None:
+            lines, lanes = tracker.update(againResized)
+        else:
+            lines = lane_detection.detect_lines(frameContext, *detectArgs)
+            if lines is not None:
+                lanes = lane_detection.detect_lanes(frameContext, lines)
+            else:
+                lanes = []
+        slInt = None
+        if drawCenter and len(lanes) != 0:
+            slInt = tracker.center(againResized) if tracker is not None and tracker.tracking else get_lane_center(frameContext, lanes)
+        if gate is not None:
+            gate.store((lines, lanes, slInt))
+    if slInt is not None:
+        draw_lane_center(againResized, slInt)
+
+    return lane_detection.draw_lanes(againResized, lanes)
+
+def videoDetection(vid, workers = None, queueDepth = 8, outputPath = 'output_video.avi', verbose = False, writePolicy = None, gate = None):
+    """Writes a video of the detected lanes and lane centers of every frame in vid
+    args:
+        vid (cv2.VideoCapture): video to detect lanes in
+        workers (int): number of detection threads; None runs everything on this thread (default None)
+        queueDepth (int): maximum frames waiting between pipeline stages when workers is set (default 8)
+        outputPath (str): path of the output AVI (default 'output_video.avi')
+        verbose (bool): print every frame number, see instrumentation for timings (default False)
+        writePolicy (str): encode the output on a background thread, 'block' or 'drop' frames when its queue is full;
+            None encodes on this thread (default None)
+        gate (motion_gate.MotionGate): skip detection on frames that barely changed, its counters report how many were skipped;
+            needs frames in order so it can't be combined with workers (default None)
+    """
+    if workers and gate is not None:
+        raise ValueError("a motion gate needs frames in order, it can't be used with workers")
+    output_video = cv2.VideoWriter(outputPath, cv2.VideoWriter_fourcc(*'XVID'), 30, (1912, 535))
+    if writePolicy:
+        output_video = video_pipeline.AsyncVideoWriter(output_video, queueDepth, writePolicy)
     # video.release() #Save video to disk.
     # total_frames = []
     # Capture frame-by-frame
 
-    count = 1
     ret, frame = vid.read()
+    if workers:
+        video_pipeline.run_pipeline(vid, process_frame, output_video.write, workers, queueDepth)
+        output_video.release()
+        return
+
+    count = 1
     while ret:
         ret, frame = vid.read()
         if ret:
-            resized = (cv2.resize(frame, (1912, 1069)))
-            h = resized.shape[0]
-            w = resized.shape[1]
-            againResized = resized[int(h/2) : h, 0 : w]
-        
-            lines = lane_detection.detect_lines(againResized, 50, 70, 3, 200, 10)
-            if lines is not None:
-                lanes = lane_detection.detect_lanes(againResized, lines)   
-            else:
-                lanes = []
-            if len(lanes) != 0:
-                slInt = get_lane_center(againResized, lanes)
-                draw_lane_center(againResized, slInt) 
-
-            againResized = lane_detection.draw_lanes(againResized, lanes)
+            againResized = process_frame(frame, gate = gate)
             # total_frames.append(frame)
             output_video.write(againResized)
 
-        print(ret)
-        print(f"Frame: {count}")
+        if verbose:
+            print(ret)
+            print(f"Frame: {count}")
         count += 1
     output_video.release()
 
@@ -84,55 +183,64 @@ def recommend_angle(slope):
     return laneAngle
     
 
-def videoDetectionFrames(vid, framesVid):
-    output_video = cv2.VideoWriter('output_video.avi', cv2.VideoWriter_fourcc(*'XVID'), 30, (1912, 535))
+def videoDetectionFrames(vid, framesVid, workers = None, queueDepth = 8, outputPath = 'output_video.avi', verbose = False, writePolicy = None, gate = None):
+    """Writes a video of the detected lanes and lane centers of the first framesVid frames in vid
+    args:
+        vid (cv2.VideoCapture): video to detect lanes in
+        framesVid (int): number of frames to process
+        workers (int): number of detection threads; None runs everything on this thread (default None)
+        queueDepth (int): maximum frames waiting between pipeline stages when workers is set (default 8)
+        outputPath (str): path of the output AVI (default 'output_video.avi')
+        verbose (bool): print every frame number, see instrumentation for timings (default False)
+        writePolicy (str): encode the output on a background thread, 'block' or 'drop' frames when its queue is full;
+            None encodes on this thread (default None)
+        gate (motion_gate.MotionGate): skip detection on frames that barely changed, its counters report how many were skipped;
+            needs frames in order so it can't be combined with workers (default None)
+    """
+    if workers and gate is not None:
+        raise ValueError("a motion gate needs frames in order, it can't be used with workers")
+    output_video = cv2.VideoWriter(outputPath, cv2.VideoWriter_fourcc(*'XVID'), 30, (1912, 535))
+    if writePolicy:
+        output_video = video_pipeline.AsyncVideoWriter(output_video, queueDepth, writePolicy)
     # video.release() #Save video to disk.
     # total_frames = []
     # Capture frame-by-frame
+    detectArgs = (50, 50, 3, 100, 10)
+
+    if workers:
+        video_pipeline.run_pipeline(vid, lambda frame: process_frame(frame, detectArgs), output_video.write,
+                                    workers, queueDepth, maxFrames = framesVid)
+        output_video.release()
+        return
 
     count = 1
     while True:
         ret, frame = vid.read()
         if ret:
-            resized = (cv2.resize(frame, (1912, 1069)))
-            h = resized.shape[0]
-            w = resized.shape[1]
-            againResized = resized[int(h/2) : h, 0 : w]
-        
-            lines = lane_detection.detect_lines(againResized, 50, 50, 3, 100, 10)
-            if lines is not None:
-                lanes = lane_detection.detect_lanes(againResized, lines)   
-            else:
-                lanes = []
-            if len(lanes) != 0:
-                slInt = get_lane_center(againResized, lanes)
-                draw_lane_center(againResized, slInt) 
-
-            againResized = lane_detection.draw_lanes(againResized, lanes)
+            againResized = process_frame(frame, detectArgs, gate = gate)
             # total_frames.append(frame)
             output_video.write(againResized)
 
-        print(ret)
-        print(f"Frame: {count}")
+        if verbose:
+            print(ret)
+            print(f"Frame: {count}")
         count += 1
         if count > framesVid: break
     output_video.release()
 
 
 
+@instrumentation.instrument('draw_lane_center')
 def draw_lane_center(img, slInt):
-    if not isinstance(img, np.ndarray):
-        image = cv2.imread(img)
-    else:
-        image = img
+    image = lane_detection.load_image(img)
 
-    if slInt is not None:
+    if slInt is not None and lane_detection.drawing_enabled():
         slope = slInt[0]
         intercept = slInt[1]
         angle = recommend_angle(slope)
         if slope == 0:
             slope = 0.0000000001
-            cv2.line(image, (0, slInt[2]), (img.shape[1], slInt[2]))
+            cv2.line(image, (0, slInt[2]), (image.shape[1], slInt[2]))
             cv2.putText(image, f'Angle: {round(angle, 3)}', (20, 300), 0, 1, (255, 0, 255), 3)
         else: 
             x2 = int((0 - (535 - slope * intercept)) / slope)
@@ -141,6 +249,7 @@ def draw_lane_center(img, slInt):
 
     return image
 
+@instrumentation.instrument('recommend_direction')
 def recommend_direction(img, center, slope):
     """Recommends the direction that the AUV should move in order to follow a lane
     args:
@@ -164,7 +273,7 @@ def recommend_direction(img, center, slope):
     # else: 
     #     turn = "don't turn"
     # return [direction, turn]
-    width = img.shape[1] / 2
+    width = lane_detection.load_image(img).shape[1] / 2
     if center >= (width - 20) and center <= (width + 20) and abs(1/slope) <= 0.1:
         direction =  "drive forward"
         return[direction]
@@ -174,20 +283,170 @@ def recommend_direction(img, center, slope):
     elif center < (width - 20):
         direction = "strafe left"
         return[direction]
-    if center >= (width - 20) and center <= (width + 20) and slope <= -0.5:
+    # centered but not straight ahead, turn toward the lane. this includes shallow slopes
+    # between -0.5 and 0.5, which used to match no branch and raise UnboundLocalError
+    if slope < 0:
         direction = "turn right"
-    if center >= (width - 20) and center <= (width + 20) and slope >= 0.5: 
+    else:
         direction = "turn left"
     return[direction]
 
 
+def analyze_frame(frame, detectArgs = (50, 70, 3, 200, 10), crop = True, gate = None, preprocessor = None):
+    """Runs detect_lines -> detect_lanes -> get_lane_center -> recommend_direction on one frame without drawing the results
+    args:
+        frame (image path, np.ndarray or FrameContext): frame to analyze
+        detectArgs (tuple): parameters passed to detect_lines
+        crop (bool): resize to 1912x1069 and keep the bottom half first, like process_frame (default True)
+        gate (motion_gate.MotionGate): return the previous frame's result when the frame barely changed (default None)
+        preprocessor (lane_detection.Preprocessor): crop and filter into its reused buffers instead, only with crop, loses lanes, see Preprocessor (default None)
+    return:
+        (dict): {"lines", "lanes", "center", "direction"} as plain lists, center and direction are None without lanes
+    """
+    img = lane_detection.load_image(frame)
+    frameContext = None
+    if crop and preprocessor is not None:
+        frameContext = preprocessor.process(img)
+        img = frameContext.image
+    elif crop:
+        resized = cv2.resize(img, (1912, 1069))
+        img = resized[int(resized.shape[0]/2) :]
+    previous = gate.reuse(img) if gate is not None else None
+    if previous is not None:
+        return previous
+    frameContext = frameContext or lane_detection.FrameContext(img)
+    lines = lane_detection.detect_lines(frameContext, *detectArgs, asArray=True, draw=False)
+    lanes = lane_detection.detect_lanes(frameContext, lines)
+    center = direction = None
+    if len(lanes) != 0:
+        center = get_lane_center(frameContext, lanes).tolist()
+        direction = recommend_direction(frameContext, center[1], center[0])
+    result = {
+        "lines": lines.tolist(),
+        "lanes": lanes.tolist(),
+        "center": center,
+        "direction": direction,
+    }
+    if gate is not None:
+        gate.store(result)
+    return result
+
+def _analyze_chunk(job, detectArgs, crop):
+    # runs in a worker process: decodes its own frames so only paths / frame numbers and small results cross processes
+    kind, source, items = job
+    if kind == 'dataset':
+        start, count = items
+        dataset = frame_dataset.FrameDataset(source)
+        return [analyze_frame(dataset[i], detectArgs, crop) for i in range(start, start + count)]
+    if kind == 'video':
+        start, count = items
+        vid = cv2.VideoCapture(source)
+        if start and not (vid.set(cv2.CAP_PROP_POS_FRAMES, start) and int(vid.get(cv2.CAP_PROP_POS_FRAMES)) == start):
+            # the container can't seek to an exact frame, step there from the start instead
+            vid.release()
+            vid = cv2.VideoCapture(source)
+            for _ in range(start):
+                if not vid.grab():
+                    break
+        results = []
+        while count is None or len(results) < count:
+            ret, frame = vid.read()
+            if not ret:
+                break
+            results.append(analyze_frame(frame, detectArgs, crop))
+        vid.release()
+        return results
+    return [analyze_frame(item, detectArgs, crop) for item in items]
+
+def _read_video(vid):
+    # yields the frames of an opened cv2.VideoCapture in order and releases it
+    while True:
+        ret, frame = vid.read()
+        if not ret:
+            break
+        yield frame
+    vid.release()
+
+def _batch_jobs(frames, chunksize):
+    # yields (kind, source, items) jobs and the names of the frames in each job
+    if frame_dataset.is_dataset(frames):
+        dataset = frame_dataset.FrameDataset(frames)
+        for start in range(0, len(dataset), chunksize):
+            count = min(chunksize, len(dataset) - start)
+            yield ('dataset', frames, (start, count)), dataset.names[start : start + count]
+        return
+    if isinstance(frames, str) and os.path.isdir(frames):
+        frames = sorted(glob.glob(os.path.join(frames, '*.jpg')) + glob.glob(os.path.join(frames, '*.png')))
+    elif isinstance(frames, str):
+        vid = cv2.VideoCapture(frames)
+        total = int(vid.get(cv2.CAP_PROP_FRAME_COUNT))
+        if total <= 0:
+            # no usable frame count: decode here in order and send the frames to the workers
+            chunk = []
+            for i, frame in enumerate(_read_video(vid)):
+                chunk.append(frame)
+                if len(chunk) == chunksize:
+                    yield ('frames', None, chunk), [f"{frames}:{j}" for j in range(i + 1 - len(chunk), i + 1)]
+                    chunk = []
+            if chunk:
+                yield ('frames', None, chunk), [f"{frames}:{j}" for j in range(i + 1 - len(chunk), i + 1)]
+            return
+        vid.release()
+        # the frame count is only an estimate for many containers, so the last job reads on to the end of the video
+        starts = range(0, total, chunksize)
+        for start in starts[:-1]:
+            yield ('video', frames, (start, chunksize)), [f"{frames}:{i}" for i in range(start, start + chunksize)]
+        yield ('video', frames, (starts[-1], None)), (f"{frames}:{i}" for i in itertools.count(starts[-1]))
+        return
+
+    chunk = []
+    for frame in frames:
+        chunk.append(frame)
+        if len(chunk) == chunksize:
+            yield ('frames', None, chunk), [f if isinstance(f, str) else None for f in chunk]
+            chunk = []
+    if chunk:
+        yield ('frames', None, chunk), [f if isinstance(f, str) else None for f in chunk]
+
+def detect_batch(frames, detectArgs = (50, 70, 3, 200, 10), workers = None, chunksize = 16, crop = True):
+    """Analyzes many frames on a process pool and yields the results in order
+    args:
+        frames (str or iterable): frame directory, video file path, frame_dataset file, or an iterable of image paths / np.ndarrays
+            (paths and videos are decoded and datasets mapped in the workers, arrays have to be sent to them)
+        detectArgs (tuple): parameters passed to detect_lines
+        workers (int): number of processes (default: number of CPUs)
+        chunksize (int): frames per job sent to a worker (default 16)
+        crop (bool): resize to 1912x1069 and keep the bottom half, like the video loops (default True)
+    yields:
+        (dict): analyze_frame result plus "index" and "source" (image path, video:frame number or None)
+    """
+    workers = workers or os.cpu_count() or 1
+    index = 0
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        pending = deque()
+        jobs = _batch_jobs(frames, chunksize)
+        for job, names in jobs:
+            pending.append((pool.submit(_analyze_chunk, job, detectArgs, crop), names))
+            # keep a couple of jobs per worker queued so results stream out without reading everything first
+            while len(pending) >= 2 * workers:
+                future, names = pending.popleft()
+                for name, result in zip(names, future.result()):
+                    yield dict(result, index=index, source=name)
+                    index += 1
+        while pending:
+            future, names = pending.popleft()
+            for name, result in zip(names, future.result()):
+                yield dict(result, index=index, source=name)
+                index += 1
+
+
 if __name__ == "__main__":
     image = cv2.imread('lanes.png')
     img = cv2.resize(image, (1912, 1069))
     lines = lane_detection.detect_lines(img, 30, 100, 3, 229, 13)
     lanes = lane_detection.detect_lanes(img, lines)
     center = get_lane_center(img, lanes)
-    action = recommend_direction(img, center[0], center[1])
+    action = recommend_direction(img, center[1], center[0])
     print(f"Possible lines: {lines}") # [[1415, 531, 1676, 563], [514, 1047, 699, 738], [1441, 573, 1674, 618], [712, 1068, 765, 839], [557, 973, 706, 725]]
     print(f"Possible lanes: {lanes}") # [[[514, 1047, 699, 738], [712, 1068, 765, 839]]]
     print(f"Center slope and intercept: {center}") # [-2.9955124936257014, 606.2985189581832]
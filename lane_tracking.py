@@ -0,0 +1,184 @@
+"""Frame-to-frame lane tracking so detection only searches near the last known lane
+
+Lane lines are tracked as x = a*y + b (lanes in the pool are close to vertical)
+with an alpha-beta (constant velocity) filter. While a lane is tracked, Canny and
+Hough only run on the columns around the predicted lane; after a few frames
+without a match the tracker falls back to searching the whole frame. With the
+RANSAC engine every frame's lines are instead refit starting from the previous
+frame's lines.
+"""
+import numpy as np
+
+import lane_detection
+import lane_following
+
+
+def line_params(line):
+    """Returns (a, b) of x = a*y + b for a line segment
+    args:
+        line (list): [x1, y1, x2, y2]
+    returns:
+        (tuple): (a, b)
+    """
+    x1, y1, x2, y2 = [float(v) for v in line]
+    if y1 == y2:
+        y2 += 0.000000001 # horizontal lines
+    a = (x2 - x1) / (y2 - y1)
+    return a, x1 - a * y1
+
+
+def lane_params(lane):
+    """Returns [a1, b1, a2, b2] of a lane, lines ordered by their x at the top of the image"""
+    params = sorted([line_params(line) for line in lane], key=lambda p: p[1])
+    return np.array(params[0] + params[1])
+
+
+class LaneTracker():
+    """Tracks one lane across video frames and restricts detection to a band around it
+    args:
+        detectArgs (tuple): threshold1, threshold2, apertureSize, minLineLength, maxLineGap passed to detect_lines
+        margin (int): pixels searched on each side of the predicted lane (default 150)
+        maxMisses (int): frames without a matching lane before falling back to full-frame search (default 3)
+        maxJump (int): largest distance in pixels a detected lane may be from the prediction to count as a match (default 200)
+        alpha (float): how much a measurement corrects the predicted lane position (default 0.6)
+        beta (float): how much a measurement corrects the predicted lane velocity (default 0.2)
+        engine (str): 'hough' runs detect_lines on the search band, 'ransac' runs detect_lines_ransac seeded with
+            the previous frame's lines, faster but it finds lanes Hough doesn't, see detect_lines_ransac (default 'hough')
+    """
+
+    def __init__(self, detectArgs = (50, 70, 3, 200, 10), margin = 150, maxMisses = 3, maxJump = 200, alpha = 0.6, beta = 0.2, engine = 'hough'):
+        if engine not in ('hough', 'ransac'):
+            raise ValueError(f"engine must be 'hough' or 'ransac', not {engine!r}")
+        self.detectArgs = detectArgs
+        self.engine = engine
+        self.margin = margin
+        self.maxMisses = maxMisses
+        self.maxJump = maxJump
+        self.alpha = alpha
+        self.beta = beta
+        self.fullSearches = 0
+        self.trackedSearches = 0
+        self.reset()
+
+    def reset(self):
+        """Forgets the tracked lane so the next frame is searched in full"""
+        self.state = None # [a1, b1, a2, b2]
+        self.velocity = np.zeros(4)
+        self.misses = 0
+        self._seedLines = None
+
+    @property
+    def tracking(self):
+        return self.state is not None
+
+    def predict(self):
+        """Returns the predicted [a1, b1, a2, b2] of the lane in the next frame, None if not tracking"""
+        if self.state is None:
+            return None
+        return self.state + self.velocity
+
+    def search_band(self, width, height):
+        """Returns the (x0, x1) columns to search around the predicted lane
+        args:
+            width (int): image width
+            height (int): image height
+        returns:
+            (tuple): first and last+1 column of the search band
+        """
+        a1, b1, a2, b2 = self.predict()
+        xs = [b1, a1 * height + b1, b2, a2 * height + b2]
+        x0 = int(max(0, min(xs) - self.margin))
+        x1 = int(min(width, max(xs) + self.margin))
+        return x0, max(x0, x1)
+
+    def _distance(self, params, height):
+        # mean horizontal distance between two lanes at the top and bottom of the image
+        a1, b1, a2, b2 = params - self.predict()
+        return (abs(b1) + abs(a1 * height + b1) + abs(b2) + abs(a2 * height + b2)) / 4
+
+    def _detect(self, img, draw):
+        height, width = img.shape[:2]
+        if self.engine == 'ransac':
+            if self._seedLines:
+                self.trackedSearches += 1
+            else:
+                self.fullSearches += 1
+            self._seedLines = lane_detection.detect_lines_ransac(img, *self.detectArgs, seedLines = self._seedLines, draw = draw)
+            return self._seedLines
+        if self.state is not None:
+            x0, x1 = self.search_band(width, height)
+            if x1 - x0 >= 2 * self.margin:
+                self.trackedSearches += 1
+                lines = lane_detection.detect_lines(img[:, x0:x1], *self.detectArgs, draw = draw)
+                return [[line[0] + x0, line[1], line[2] + x0, line[3]] for line in lines]
+        self.fullSearches += 1
+        return lane_detection.detect_lines(img, *self.detectArgs, draw = draw)
+
+    def update(self, img, draw = None):
+        """Detects lines and lanes in the next frame, searching near the tracked lane when there is one
+        args:
+            img (np.ndarray or FrameContext): frame to detect lanes in
+            draw (bool): draw the lines on img like detect_lines does, None follows set_drawing (default None)
+        returns:
+            (list, list): lines [[x1, y2, x2, y2], ...] and lanes [[[x, x, x, x], [x, x, x, x]], ...] in img's coordinates
+        """
+        img = lane_detection.load_image(img)
+        height = img.shape[0]
+        lines = self._detect(img, draw)
+        lanes = lane_detection.detect_lanes(img, lines)
+
+        if self.state is None:
+            if len(lanes) != 0:
+                # start tracking the lane closest to the middle of the image
+                _, intercepts = lane_detection.get_slopes_intercepts(img, np.reshape(lanes, (-1, 4)))
+                middles = intercepts.reshape(-1, 2).mean(axis=1)
+                lane = lanes[int(np.argmin(np.abs(middles - img.shape[1] / 2)))]
+                self.state = lane_params(lane)
+                self.velocity = np.zeros(4)
+                self.misses = 0
+            return lines, lanes
+
+        match = None
+        if len(lanes) != 0:
+            candidates = [lane_params(lane) for lane in lanes]
+            distances = [self._distance(params, height) for params in candidates]
+            best = int(np.argmin(distances))
+            if distances[best] <= self.maxJump:
+                match = candidates[best]
+
+        predicted = self.predict()
+        if match is None:
+            self.misses += 1
+            self.state = predicted
+            if self.misses > self.maxMisses:
+                self.reset()
+        else:
+            residual = match - predicted
+            self.state = predicted + self.alpha * residual
+            self.velocity = self.velocity + self.beta * residual
+            self.misses = 0
+        return lines, lanes
+
+    def lane(self, height):
+        """Returns the filtered tracked lane as two lines spanning the image height, None if not tracking
+        args:
+            height (int): image height
+        returns:
+            (list): [[x1, y1, x2, y2], [x1, y1, x2, y2]]
+        """
+        if self.state is None:
+            return None
+        a1, b1, a2, b2 = self.state
+        return [[int(a1 * height + b1), height, int(b1), 0], [int(a2 * height + b2), height, int(b2), 0]]
+
+    def center(self, img):
+        """Returns get_lane_center of the filtered tracked lane, None if not tracking
+        args:
+            img (np.ndarray): current frame
+        returns:
+            (lane_following.LaneCenter): [centerSlope, centerIntercept, centerInterceptY]
+        """
+        lane = self.lane(img.shape[0])
+        if lane is None:
+            return None
+        return lane_following.get_lane_center(img, [lane])
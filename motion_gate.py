@@ -0,0 +1,70 @@
+"""Cheap change detector that lets the detection loops skip frames that barely changed
+
+A frame is shrunk to a small grayscale thumbnail and compared with the thumbnail
+of the last frame that was actually processed. While the mean absolute
+difference stays under the threshold the previous frame's results are reused.
+"""
+import cv2
+
+
+class MotionGate():
+    """Decides whether a frame changed enough to run detection on it again
+    args:
+        threshold (float): mean absolute thumbnail difference (0-255) a frame needs to be processed (default 2.0)
+        size (tuple): (width, height) of the thumbnails compared (default (64, 36))
+        maxSkips (int): process at least every maxSkips + 1 frames even without change, None never forces (default 30)
+    """
+
+    def __init__(self, threshold = 2.0, size = (64, 36), maxSkips = 30):
+        self.threshold = threshold
+        self.size = size
+        self.maxSkips = maxSkips
+        self.frames = 0
+        self.skipped = 0
+        self.lastDifference = None
+        self.result = None
+        self._reference = None
+        self._pending = None
+        self._skipsInRow = 0
+
+    def thumbnail(self, img):
+        """Returns the small grayscale image frames are compared by"""
+        small = cv2.resize(img, self.size, interpolation=cv2.INTER_AREA)
+        return cv2.cvtColor(small, cv2.COLOR_BGR2GRAY) if small.ndim == 3 else small
+
+    def reuse(self, img):
+        """Checks a frame against the last processed one
+        args:
+            img (np.ndarray): new frame
+        returns:
+            the result stored for the last processed frame if img hasn't meaningfully changed, otherwise None
+            (process img and call store() with its result)
+        """
+        self.frames += 1
+        self._pending = self.thumbnail(img)
+        if self._reference is None or self.result is None:
+            return None
+        self.lastDifference = float(cv2.absdiff(self._pending, self._reference).mean())
+        forced = self.maxSkips is not None and self._skipsInRow >= self.maxSkips
+        if self.lastDifference > self.threshold or forced:
+            return None
+        self.skipped += 1
+        self._skipsInRow += 1
+        return self.result
+
+    def store(self, result):
+        """Remembers the result of the frame last passed to reuse(), later frames are compared against that frame"""
+        self._reference = self._pending
+        self.result = result
+        self._skipsInRow = 0
+
+    def reset(self):
+        """Forgets the reference frame so the next frame is always processed"""
+        self._reference = None
+        self.result = None
+        self._skipsInRow = 0
+
+    @property
+    def skipRate(self):
+        """Share of frames whose results were reused"""
+        return self.skipped / self.frames if self.frames else 0.0
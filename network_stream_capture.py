@@ -1,33 +1,153 @@
 import argparse
+import threading
+import time
 
 import cv2
 
 
-def main(ip_address):
-    vcap = cv2.VideoCapture(f"rtsp://{ip_address}:8554/rovcam")
+class LatestFrameGrabber():
+    """Reads a video stream on a background thread and keeps only the newest frame
 
-    try:
-        while True:
-            # Obtain the frame
-            ret, frame = vcap.read()
+    Frames that are replaced before anyone reads them are counted as dropped,
+    so a slow consumer always gets a frame that is at most one frame old. A
+    failed read ends a file, a network stream is retried until it is released.
 
-            # Check frame was received successfully
-            if ret:
-                print(" YOU GOT THIS ")
-                print(frame.shape)
-                # TODO: Do something with the frame here
+    Attributes:
+        capture (cv2.VideoCapture): stream being read
+        sequence (int): sequence number of the newest frame (0 before the first frame)
+        dropped (int): frames replaced before they were read
+    """
 
+    def __init__(self, capture, live=None):
+        """
+        Args:
+            capture (cv2.VideoCapture or str): capture or URL to open
+            live (bool, optional): retry failed reads instead of ending, defaults
+                to True for URLs and captures that report no frame count
+        """
+        if live is None:
+            if isinstance(capture, str):
+                live = '://' in capture
             else:
-                pass
+                live = capture.get(cv2.CAP_PROP_FRAME_COUNT) <= 0
+        if isinstance(capture, str):
+            capture = cv2.VideoCapture(capture)
+        self.capture = capture
+        self.live = live
+        self.sequence = 0
+        self.dropped = 0
+        self._frame = None
+        self._timestamp = None
+        self._read_sequence = 0
+        self._condition = threading.Condition()
+        self._running = True
+        self._stopped = False
+        self._release_capture = False
+        self._thread = threading.Thread(target=self._grab, daemon=True)
+        self._thread.start()
+
+    def _grab(self):
+        backoff = 0.005
+        while self._running:
+            ret, frame = self.capture.read()
+            if not ret:
+                if not self.live or not self.capture.isOpened():
+                    break
+                # the stream is still open but stalled, wait a little longer each time instead of spinning
+                time.sleep(backoff)
+                backoff = min(backoff * 2, 0.5)
+                continue
+            backoff = 0.005
+            timestamp = time.time()
+            with self._condition:
+                if self.sequence > self._read_sequence:
+                    self.dropped += 1
+                self._frame = frame
+                self._timestamp = timestamp
+                self.sequence += 1
+                self._condition.notify_all()
+        with self._condition:
+            self._running = False
+            self._stopped = True
+            self._condition.notify_all()
+            if self._release_capture:
+                self.capture.release()
+
+    def finished(self):
+        """Check if the stream has ended
+
+        Returns:
+            bool: true once the grab thread stopped, tells a timed out read() apart from the end
+        """
+        return self._stopped
+
+    def read(self, newer_than=None, timeout=None):
+        """Get the newest frame
+
+        Args:
+            newer_than (int, optional): wait for a frame with a sequence
+                number above this, defaults to the last frame read
+            timeout (float, optional): seconds to wait, None waits forever
+
+        Returns:
+            tuple: (frame, capture timestamp, sequence number), or
+                (None, None, None) on timeout or when the stream ended
+        """
+        if newer_than is None:
+            newer_than = self._read_sequence
+        with self._condition:
+            if not self._condition.wait_for(lambda: self.sequence > newer_than or not self._running, timeout):
+                return None, None, None
+            if self.sequence <= newer_than:
+                return None, None, None
+            self._read_sequence = self.sequence
+            return self._frame, self._timestamp, self.sequence
 
+    def release(self, timeout=1.0):
+        """Stop the grab thread and close the stream
+
+        Args:
+            timeout (float, optional): seconds to wait for the grab thread, if it
+                is still blocked in a read after that it closes the stream itself
+        """
+        self._running = False
+        self._thread.join(timeout)
+        with self._condition:
+            if not self._stopped:
+                self._release_capture = True
+                return
+        self.capture.release()
+
+
+def main(ip_address, latest=False):
+    url = f"rtsp://{ip_address}:8554/rovcam"
+
+    if latest:
+        grabber = LatestFrameGrabber(url)
+        try:
+            while True:
+                frame, timestamp, sequence = grabber.read(timeout=1.0)
+                if frame is not None:
+                    print(f"Frame {sequence} ({(time.time() - timestamp) * 1000:.1f} ms old, {grabber.dropped} dropped)")
+                elif grabber.finished():
+                    break
+        except KeyboardInterrupt:
+            pass
+        grabber.release()
+        return
+
+    import runner
+    try:
+        # steering decisions go to stdout as JSON lines
+        runner.run(url)
     except KeyboardInterrupt:
-        # Close the connection
-        vcap.release()
+        pass
 
 
 if __name__ == "__main__":
     parser = argparse.ArgumentParser(description="Network Stream Capture")
     parser.add_argument("--ip", type=str, help="IP Address of the Network Stream")
+    parser.add_argument("--latest", action="store_true", help="Grab frames on a background thread and only keep the newest")
     args = parser.parse_args()
 
-    main(args.ip)
+    main(args.ip, args.latest)
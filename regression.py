@@ -0,0 +1,351 @@
+"""Golden-output regression check for lane detection and its fast paths
+
+Stores the lines, lanes, lane center and recommended direction the reference
+path (list based detect_lines -> detect_lanes -> get_lane_center ->
+recommend_direction on the 1912x535 bottom-half crop) finds on the bundled
+images and vidFrames/, plus the frames per second of the production path.
+A check re-runs every fast path against those results:
+
+    exact paths (must reproduce the golden output):
+        array    analyze_frame / asArray detection
+        batch    detect_batch on a process pool
+    approximate paths (must stay within what steering tolerates):
+        tracked  LaneTracker over the frames in order
+        every other setting runner.LEVELS lets runner.py drop to when over budget
+    degraded paths runner.py never selects on its own (scored the same, reported as WARN instead of failing unless --strict):
+        pyramid1, pyramid2  detection on pyramid level 1 and 2
+        preprocessed        Preprocessor cropping before resizing into reused buffers, opt-in
+
+checks that MotionGate really reuses results on near-duplicate frames, that a
+slow guidance_server client only ever gets the newest guidance, and fails if
+frames per second dropped below the recorded baseline.
+
+    python regression.py            # check, exit code 1 on failure
+    python regression.py --update   # re-record golden outputs and the fps baseline
+"""
+import argparse
+import asyncio
+import glob
+import json
+import os
+import platform
+import sys
+import tempfile
+import time
+
+import cv2
+import numpy as np
+
+import guidance_server
+import lane_detection
+import lane_following
+import lane_tracking
+import motion_gate
+import runner
+
+GOLDEN_PATH = 'regression_golden.json'
+IMAGES = sorted(glob.glob('vidFrames/*.jpg')) + ['516.jpg', '2174.jpg', 'aaaaaa.jpg']
+DETECT_ARGS = (50, 70, 3, 200, 10)
+
+# what steering tolerates from an approximate path, scored on the frames golden or the path find a lane on:
+#   center_px  lane center intercept error where both find a lane, recommend_direction's dead band is +-20 px
+#   recall     share of golden lanes the path finds, a tracker bridges the odd missed frame but not more
+#   precision  share of the path's lanes golden has too, a phantom lane steers the vehicle off course
+#   direction  share of frames with a lane in both where the recommended direction is the same
+STEERING_TOLERANCE = {"center_px": 20, "recall": 0.75, "precision": 0.75, "direction": 1.0}
+EXACT_PATHS = ["array", "batch"]
+DEGRADED_PATHS = ["pyramid1", "pyramid2", "preprocessed"]
+FPS_TOLERANCE = 0.25
+# messages a slow guidance_server client may be behind the newest frame when it receives one
+SERVER_MAX_LAG = 2
+
+
+def _crop(img):
+    resized = cv2.resize(img, (1912, 1069))
+    return np.ascontiguousarray(resized[int(resized.shape[0]/2):])
+
+def load_frames(images = IMAGES):
+    """Returns {path: 1912x535 bottom-half crop} of the images that could be read"""
+    frames = {}
+    for path in images:
+        img = cv2.imread(path)
+        if img is not None:
+            frames[path] = _crop(img)
+    return frames
+
+
+def _result(img, lines, lanes, center, direction = None):
+    # the plain-list record every path is compared in, direction is recommended here unless the path gave one
+    if center is not None:
+        if direction is None:
+            direction = lane_following.recommend_direction(img, center[1], center[0])
+        direction = direction[0]
+        center = [float(center[0]), float(center[1])]
+    return {
+        "lines": np.asarray(lines, dtype=np.int64).reshape(-1, 4).tolist(),
+        "lanes": np.asarray(lanes, dtype=np.int64).reshape(-1, 2, 4).tolist(),
+        "center": center,
+        "direction": direction,
+    }
+
+def reference(frames):
+    """Runs the original list based path, returns {path: result}"""
+    results = {}
+    for path, frame in frames.items():
+        img = frame.copy()
+        lines = lane_detection.detect_lines(img, *DETECT_ARGS)
+        lanes = lane_detection.detect_lanes(img, lines)
+        center = lane_following.get_lane_center(img, lanes) if len(lanes) != 0 else None
+        results[path] = _result(img, lines, lanes, center)
+    return results
+
+def run_array(frames):
+    results = {}
+    for path, frame in frames.items():
+        result = lane_following.analyze_frame(frame, DETECT_ARGS, crop=False)
+        results[path] = _result(frame, result["lines"], result["lanes"], result["center"], result["direction"])
+    return results
+
+def run_batch(frames):
+    results = lane_following.detect_batch(list(frames), DETECT_ARGS, workers=2, chunksize=4)
+    return {path: _result(frame, r["lines"], r["lanes"], r["center"], r["direction"]) for (path, frame), r in zip(frames.items(), results)}
+
+def run_pyramid(frames, level = 1):
+    results = {}
+    for path, frame in frames.items():
+        img = frame.copy()
+        lines = lane_detection.detect_lines(img, *DETECT_ARGS, level = level)
+        lanes = lane_detection.detect_lanes(img, lines)
+        center = lane_following.get_lane_center(img, lanes) if len(lanes) != 0 else None
+        results[path] = _result(img, lines, lanes, center)
+    return results
+
+def run_tracked(frames):
+    tracker = lane_tracking.LaneTracker(DETECT_ARGS)
+    results = {}
+    for path, frame in frames.items():
+        img = frame.copy()
+        lines, lanes = tracker.update(img)
+        center = None
+        if len(lanes) != 0:
+            center = tracker.center(img) if tracker.tracking else lane_following.get_lane_center(img, lanes)
+        results[path] = _result(img, lines, lanes, center)
+    return results
+
+def run_gated(frames):
+    """Runs analyze_frame with a MotionGate over every frame followed by a copy with +-1 noise added
+    returns:
+        (dict, int): {path: result of the noisy copy} and the number of frames the gate skipped
+    """
+    gate = motion_gate.MotionGate()
+    rng = np.random.default_rng(0)
+    results = {}
+    for path, frame in frames.items():
+        lane_following.analyze_frame(frame, DETECT_ARGS, crop=False, gate=gate)
+        noisy = np.clip(frame.astype(np.int16) + rng.integers(-1, 2, frame.shape), 0, 255).astype(np.uint8)
+        result = lane_following.analyze_frame(noisy, DETECT_ARGS, crop=False, gate=gate)
+        results[path] = _result(noisy, result["lines"], result["lanes"], result["center"], result["direction"])
+    return results, gate.skipped
+
+def run_preprocessed(frames, images = IMAGES):
+    # the Preprocessor works on the raw frames, its crop comes out slightly different from resizing first
+    results = {}
+    preprocessors = {}
+    for path in frames:
+        raw = cv2.imread(path)
+        size = (raw.shape[1], raw.shape[0])
+        preprocessor = preprocessors.setdefault(size, lane_detection.Preprocessor(size, detectArgs = DETECT_ARGS))
+        result = lane_following.analyze_frame(raw, DETECT_ARGS, preprocessor = preprocessor)
+        results[path] = _result(preprocessor.image, result["lines"], result["lanes"], result["center"], result["direction"])
+    return results
+
+def runner_paths(levels = None):
+    """Returns the names of the paths that runner.py steers on at the given ladder levels (default runner.LEVELS)"""
+    names = []
+    for _, pyramidLevel, track in (runner.LEVELS if levels is None else levels):
+        name = "tracked" if track else f"pyramid{pyramidLevel}" if pyramidLevel else "array"
+        if name not in names:
+            names.append(name)
+    return names
+
+PATHS = {"array": run_array, "batch": run_batch, "tracked": run_tracked, "preprocessed": run_preprocessed}
+for level in (1, 2):
+    PATHS[f"pyramid{level}"] = lambda frames, level = level: run_pyramid(frames, level)
+
+
+class _RepeatedFrames(runner.FrameSource):
+    # hands out the same frames over and over like a live stream, count frames in total
+    def __init__(self, frames, count):
+        self.frames = list(frames)
+        self.count = count
+        self.index = 0
+        self.live = True
+
+    def read(self):
+        if self.index >= self.count:
+            return None, None
+        self.index += 1
+        return self.frames[self.index % len(self.frames)], self.index / 30
+
+    def release(self):
+        pass
+
+def run_server(frames, messages = 20, readEvery = 0.1, rate = 30):
+    """Serves frames over and over with a GuidanceServer at rate to a client that reads a message every readEvery seconds
+    returns:
+        (list): how many messages the server had produced past each message when the client got it
+    """
+    async def serve():
+        path = os.path.join(tempfile.mkdtemp(), 'guidance.sock')
+        server = guidance_server.GuidanceServer(_RepeatedFrames(frames.values(), int(messages * readEvery * rate * 4)), DETECT_ARGS, rate)
+        serving = asyncio.create_task(server.serve(path=path))
+        while not os.path.exists(path):
+            await asyncio.sleep(0.01)
+        lags = []
+        received = guidance_server.subscribe(path=path)
+        async for message in received:
+            lags.append(server.sequence - message["seq"])
+            if len(lags) == messages:
+                break
+            await asyncio.sleep(readEvery)
+        await received.aclose()
+        serving.cancel()
+        try:
+            await serving
+        except asyncio.CancelledError:
+            pass
+        os.remove(path)
+        os.rmdir(os.path.dirname(path))
+        return lags
+    return asyncio.run(serve())
+
+
+def agreement(results, golden):
+    """Compares results of a path with the golden ones
+    args:
+        results (dict): {path: result} of the path
+        golden (dict): {path: result} recorded by --update
+    returns:
+        (dict): {"exact", "center_px", "recall", "precision", "direction", "lanes"}, see STEERING_TOLERANCE
+            exact is True if every result is identical, lanes counts the golden frames with a lane
+    """
+    errors = []
+    expectedLanes = foundLanes = bothLanes = sameDirection = 0
+    for path, expected in golden.items():
+        result = results[path]
+        expectedLanes += expected["center"] is not None
+        foundLanes += result["center"] is not None
+        if result["center"] is not None and expected["center"] is not None:
+            bothLanes += 1
+            sameDirection += result["direction"] == expected["direction"]
+            errors.append(abs(result["center"][1] - expected["center"][1]))
+    return {
+        "exact": all(results[path] == expected for path, expected in golden.items()),
+        "center_px": max(errors) if errors else 0.0,
+        "recall": bothLanes / expectedLanes if expectedLanes else 1.0,
+        "precision": bothLanes / foundLanes if foundLanes else 1.0,
+        "direction": sameDirection / bothLanes if bothLanes else 1.0,
+        "lanes": expectedLanes,
+    }
+
+def measure_fps(frames, repeats = 3):
+    """Returns the best frames per second of analyze_frame (the production path) over frames"""
+    best = 0.0
+    for _ in range(repeats):
+        start = time.perf_counter()
+        for frame in frames.values():
+            lane_following.analyze_frame(frame, DETECT_ARGS, crop=False)
+        best = max(best, len(frames) / (time.perf_counter() - start))
+    return best
+
+
+def check(golden, frames, strict = False):
+    """Runs every path and the fps measurement against golden
+    args:
+        golden (dict): contents of the golden file
+        frames (dict): load_frames() result
+        strict (bool): fail on degraded paths outside STEERING_TOLERANCE too (default False)
+    returns:
+        (list): failure messages, empty when everything passed
+    """
+    failures = []
+    for path in golden["frames"]:
+        if path not in frames:
+            failures.append(f"missing frame {path}")
+    if failures:
+        return failures
+
+    expected = golden["frames"]
+    failures += [f"reference: {path} differs from golden" for path, result in reference(frames).items() if result != expected[path]]
+    limits = STEERING_TOLERANCE
+    steered = runner_paths()
+    for name, run in PATHS.items():
+        stats = agreement(run(frames), expected)
+        if name in EXACT_PATHS:
+            ok = stats["exact"]
+        else:
+            ok = (stats["center_px"] <= limits["center_px"] and stats["recall"] >= limits["recall"]
+                  and stats["precision"] >= limits["precision"] and stats["direction"] >= limits["direction"])
+        warn = not ok and name in DEGRADED_PATHS and name not in steered and not strict
+        print(f"{name:<13}{'exact' if stats['exact'] else '':>6}  center {stats['center_px']:6.1f} px  recall {stats['recall']:4.0%}  "
+              f"precision {stats['precision']:4.0%}  direction {stats['direction']:4.0%}  {'ok' if ok else 'WARN' if warn else 'FAIL'}")
+        if not ok and not warn:
+            failures.append(f"{name}: {stats}")
+
+    # every noisy copy has to be skipped and get exactly the golden result of the frame it copies
+    results, skipped = run_gated(frames)
+    ok = skipped == len(frames) and agreement(results, expected)["exact"]
+    print(f"{'gated':<13}{'exact' if ok else '':>6}  skipped {skipped} of {len(frames)} near-duplicate frames  {'ok' if ok else 'FAIL'}")
+    if not ok:
+        failures.append(f"gated: skipped {skipped} of {len(frames)} near-duplicates, results exact: {agreement(results, expected)['exact']}")
+
+    # a client reading slower than frames are produced must still only get the newest guidance
+    lags = run_server(frames)
+    ok = len(lags) > 0 and max(lags) <= SERVER_MAX_LAG
+    print(f"{'server':<13}{'':>6}  slow client got {len(lags)} messages, at most {max(lags, default=0)} behind the newest  {'ok' if ok else 'FAIL'}")
+    if not ok:
+        failures.append(f"server: slow client messages up to {max(lags, default=0)} behind the newest, allowed {SERVER_MAX_LAG}")
+
+    if golden.get("fps"):
+        fps = measure_fps(frames)
+        floor = golden["fps"] * (1 - FPS_TOLERANCE)
+        print(f"{'fps':<13}{fps:7.1f} (baseline {golden['fps']:.1f}, floor {floor:.1f})  {'ok' if fps >= floor else 'FAIL'}")
+        if fps < floor:
+            failures.append(f"fps {fps:.1f} below {floor:.1f}")
+    return failures
+
+def update(frames, path = GOLDEN_PATH):
+    """Records the reference results and the fps baseline to path"""
+    golden = {
+        "detect_args": list(DETECT_ARGS),
+        "machine": platform.platform(),
+        "fps": measure_fps(frames),
+        "frames": reference(frames),
+    }
+    with open(path, 'w') as f:
+        json.dump(golden, f, indent=1)
+    return golden
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Check lane detection fast paths against golden outputs")
+    parser.add_argument("--golden", type=str, default=GOLDEN_PATH, help="golden results file")
+    parser.add_argument("--update", action="store_true", help="re-record the golden results and fps baseline")
+    parser.add_argument("--no-fps", action="store_true", help="skip the fps check (e.g. on a different machine)")
+    parser.add_argument("--strict", action="store_true", help="also fail when a degraded path is outside the steering tolerance")
+    args = parser.parse_args()
+
+    frames = load_frames()
+    if args.update:
+        golden = update(frames, args.golden)
+        print(f"Recorded {len(golden['frames'])} frames, {golden['fps']:.1f} fps baseline to {args.golden}")
+        sys.exit(0)
+
+    with open(args.golden) as f:
+        golden = json.load(f)
+    if args.no_fps:
+        golden["fps"] = None
+    failures = check(golden, frames, args.strict)
+    for failure in failures:
+        print(f"FAIL {failure}")
+    sys.exit(1 if failures else 0)
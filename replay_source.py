@@ -0,0 +1,169 @@
+#!/usr/bin/env python
+"""
+Record-and-replay stand-in for the BlueRov video stream
+"""
+
+import glob
+import os
+import random
+import threading
+import time
+
+import cv2
+
+
+class ReplayVideo():
+    """Plays recorded frames through the same interface as video_camera.Video
+
+    An emulator thread delivers frames at the recording's frame rate (times
+    speed), optionally with random jitter and dropped frames, so the capture
+    and processing loop can be load tested without the vehicle.
+
+    Attributes:
+        source (string): Video file or directory of images being replayed
+        fps (float): Frame rate frames are delivered at before speed is applied
+        speed (float): Playback speed multiplier, 0 delivers as fast as possible
+        jitter (float): Standard deviation in seconds of random delivery delay
+        drop_rate (float): Probability of a frame being dropped
+        loop (bool): Start again at the end of the source
+        latest_frame (np.ndarray): Latest retrieved video frame
+        delivered (int): Frames handed to the consumer
+        dropped (int): Frames dropped by drop_rate
+        overwritten (int): Frames replaced before frame() consumed them
+    """
+
+    def __init__(self, source, fps=None, speed=1.0, jitter=0.0, drop_rate=0.0, loop=False, seed=None):
+        """Summary
+
+        Args:
+            source (string): Video file or directory of .jpg/.png frames
+            fps (float, optional): Frame rate to deliver at, defaults to a
+                video file's own rate and 30 for image directories
+            speed (float, optional): Playback speed multiplier
+            jitter (float, optional): Delivery jitter standard deviation (s)
+            drop_rate (float, optional): Probability of dropping a frame
+            loop (bool, optional): Replay the source forever
+            seed (int, optional): Random seed for jitter and drops
+        """
+        self.source = source
+        self.speed = speed
+        self.jitter = jitter
+        self.drop_rate = drop_rate
+        self.loop = loop
+        self.latest_frame = self._new_frame = None
+        self.delivered = self.dropped = self.overwritten = 0
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+        self._finished = threading.Event()
+
+        if os.path.isdir(source):
+            self._paths = sorted(glob.glob(os.path.join(source, '*.jpg')) + glob.glob(os.path.join(source, '*.png')))
+            self.fps = fps or 30.0
+        else:
+            self._paths = None
+            capture = cv2.VideoCapture(source)
+            self.fps = fps or capture.get(cv2.CAP_PROP_FPS) or 30.0
+            capture.release()
+
+        self._thread = threading.Thread(target=self.run, daemon=True)
+        self._thread.start()
+
+    def _frames(self):
+        """Yield decoded frames from the source once"""
+        if self._paths is not None:
+            for path in self._paths:
+                frame = cv2.imread(path)
+                if frame is not None:
+                    yield frame
+            return
+        capture = cv2.VideoCapture(self.source)
+        while True:
+            ret, frame = capture.read()
+            if not ret:
+                break
+            yield frame
+        capture.release()
+
+    def run(self):
+        """ Deliver frames at the configured pace until the source ends
+        """
+        interval = 1 / (self.fps * self.speed) if self.speed > 0 else 0
+        next_time = time.monotonic()
+        while not self._finished.is_set():
+            for frame in self._frames():
+                next_time += interval
+                delay = next_time - time.monotonic()
+                if self.jitter:
+                    delay += abs(self._random.gauss(0, self.jitter))
+                if delay > 0 and self._finished.wait(delay):
+                    return
+                if self._random.random() < self.drop_rate:
+                    self.dropped += 1
+                    continue
+                with self._lock:
+                    if self._new_frame is not None:
+                        self.overwritten += 1
+                    self._new_frame = frame
+                    self.delivered += 1
+            if not self.loop:
+                break
+        self._finished.set()
+
+    def frame(self):
+        """ Get Frame
+
+        Returns:
+            np.ndarray: latest retrieved image frame
+        """
+        if self.frame_available():
+            with self._lock:
+                self.latest_frame = self._new_frame
+                # reset to indicate latest frame has been 'consumed'
+                self._new_frame = None
+        return self.latest_frame
+
+    def frame_available(self):
+        """Check if a new frame is available
+
+        Returns:
+            bool: true if a new frame is available
+        """
+        return self._new_frame is not None
+
+    def finished(self):
+        """Check if the whole source has been delivered
+
+        Returns:
+            bool: true once the last frame was delivered (never when looping)
+        """
+        return self._finished.is_set()
+
+    def stop(self):
+        """Stop delivering frames"""
+        self._finished.set()
+        self._thread.join()
+
+
+if __name__ == '__main__':
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Replay recorded frames like the BlueRov stream")
+    parser.add_argument("source", nargs="?", default="vidFrames", help="video file or frame directory")
+    parser.add_argument("--speed", type=float, default=1.0, help="playback speed multiplier, 0 for as fast as possible")
+    parser.add_argument("--jitter", type=float, default=0.0, help="delivery jitter standard deviation in seconds")
+    parser.add_argument("--drop-rate", type=float, default=0.0, help="probability of dropping a frame")
+    parser.add_argument("--loop", action="store_true", help="replay forever")
+    args = parser.parse_args()
+
+    video = ReplayVideo(args.source, speed=args.speed, jitter=args.jitter, drop_rate=args.drop_rate, loop=args.loop)
+    start = time.monotonic()
+    received = 0
+    while not video.finished() or video.frame_available():
+        if video.frame_available():
+            video.frame()
+            received += 1
+        else:
+            time.sleep(0.001)
+    elapsed = time.monotonic() - start
+    print(f"Received {received} frames in {elapsed:.2f} s ({received / elapsed:.1f} fps), "
+          f"{video.dropped} dropped, {video.overwritten} overwritten")
@@ -0,0 +1,300 @@
+"""One entry point for lane following on any frame source
+
+Reads frames from a video file, frame directory, frame_dataset file, RTSP URL
+or the BlueRov UDP stream, runs detect_lines -> detect_lanes -> get_lane_center
+-> recommend_direction on the bottom half of each one at a target rate and
+writes every steering decision as a timestamped JSON line.
+
+Each frame has a latency budget. When detection keeps running over it the
+runner steps down a ladder of cheaper settings (no overlays, then searching
+only around the lane found in the last frames with lane_tracking.LaneTracker)
+and climbs back up once there is headroom again.
+
+    python runner.py vidFrames --rate 10 --output steering.jsonl
+    python runner.py rtsp://192.168.2.2:8554/rovcam --budget-ms 60
+    python runner.py udp:5600 --video overlay.avi
+    python runner.py AUV_Vid.mkv --replay --speed 2
+"""
+import argparse
+import glob
+import json
+import os
+import sys
+import time
+
+import cv2
+
+import frame_dataset
+import lane_detection
+import lane_following
+import lane_tracking
+import video_pipeline
+
+DETECT_ARGS = (50, 70, 3, 200, 10)
+
+# degradation ladder from best to cheapest: (draw overlays, pyramid level, track the lane with a LaneTracker)
+# regression.py fails when a rung steers outside its STEERING_TOLERANCE, which pyramid levels 1 and 2 do
+# (recall 75% / precision 60% and 50% / 67%), tracking stays within it at about half the cost of a full search
+LEVELS = [(True, 0, False), (False, 0, False), (False, 0, True)]
+
+
+class FrameSource():
+    """Reads (frame, timestamp) pairs from any of the sources the runner accepts
+
+    Live sources (RTSP, UDP, replay) hand out the newest frame and skip the ones
+    that arrived while the last frame was being processed, offline sources
+    (video file, frame directory, frame_dataset file) hand out every frame in order.
+    args:
+        source (str): video file, frame directory, frame_dataset file, rtsp:// or http:// URL, or udp[:port]
+        replay (bool): play a file or directory through replay_source.ReplayVideo at its own frame rate (default False)
+        speed (float): replay speed multiplier (default 1.0)
+        fps (float): frame rate of frame directories used for their timestamps, and replay rate (default: 30 for directories, a video's own rate)
+        timeout (float): seconds without a new frame after which a network stream counts as ended (default 5.0)
+    """
+
+    def __init__(self, source, replay = False, speed = 1.0, fps = None, timeout = 5.0):
+        self.source = source
+        self.fps = fps
+        self.timeout = timeout
+        self.index = 0
+        self.live = True
+        self._video = self._grabber = self._capture = self._paths = self._dataset = None
+        if source == 'udp' or source.startswith('udp:'):
+            import video_camera
+            self._video = video_camera.Video(int(source[4:] or 5600))
+        elif source.startswith(('rtsp://', 'http://', 'https://')):
+            import network_stream_capture
+            self._grabber = network_stream_capture.LatestFrameGrabber(source)
+        elif replay:
+            import replay_source
+            self._video = replay_source.ReplayVideo(source, fps=fps, speed=speed)
+        else:
+            self.live = False
+            if frame_dataset.is_dataset(source):
+                self._dataset = frame_dataset.FrameDataset(source)
+            elif os.path.isdir(source):
+                self._paths = sorted(glob.glob(os.path.join(source, '*.jpg')) + glob.glob(os.path.join(source, '*.png')))
+            else:
+                self._capture = cv2.VideoCapture(source)
+
+    def read(self):
+        """Returns the next frame and its timestamp in seconds, (None, None) once the source has ended"""
+        if self._grabber is not None:
+            frame, timestamp, _ = self._grabber.read(timeout=self.timeout)
+            return frame, timestamp
+        if self._video is not None:
+            finished = getattr(self._video, 'finished', lambda: False)
+            while not self._video.frame_available():
+                if finished():
+                    return None, None
+                time.sleep(0.001)
+            return self._video.frame(), time.time()
+        if self._dataset is not None:
+            if self.index >= len(self._dataset):
+                return None, None
+            frame, timestamp = self._dataset[self.index], self._dataset.timestamps[self.index]
+        elif self._paths is not None:
+            frame = None
+            while frame is None and self.index < len(self._paths):
+                frame = cv2.imread(self._paths[self.index])
+                if frame is None:
+                    self.index += 1
+            if frame is None:
+                return None, None
+            timestamp = self.index / (self.fps or 30.0)
+        else:
+            ret, frame = self._capture.read()
+            if not ret:
+                return None, None
+            timestamp = self._capture.get(cv2.CAP_PROP_POS_MSEC) / 1000
+        self.index += 1
+        return frame, timestamp
+
+    def release(self):
+        """Stops background threads and closes the source"""
+        if self._grabber is not None:
+            self._grabber.release()
+        if self._capture is not None:
+            self._capture.release()
+        if hasattr(self._video, 'stop'):
+            self._video.stop()
+
+
+class Runner():
+    """Turns frames into steering decisions while keeping per-frame latency under a budget
+    args:
+        detectArgs (tuple): parameters passed to detect_lines (default DETECT_ARGS)
+        budget (float): seconds a frame may take (default 0.1)
+        overlays (bool): draw lines, lanes and the lane center on the frames while there is time for it (default False)
+        smoothing (float): weight of the newest latency in the running average the ladder follows (default 0.3)
+        settle (int): frames to wait after a change before changing level again (default 5)
+        preprocess (bool): crop before resizing into reused lane_detection.Preprocessor buffers, faster but against the
+            exact resize-then-crop path it finds only 50% of the lanes and 1 in 3 of its lanes are phantoms (regression.py) (default False)
+    """
+
+    def __init__(self, detectArgs = DETECT_ARGS, budget = 0.1, overlays = False, smoothing = 0.3, settle = 5, preprocess = False):
+        self.detectArgs = detectArgs
+        self.budget = budget
+        self.smoothing = smoothing
+        self.settle = settle
+        self.minLevel = 0 if overlays else 1
+        self.level = self.minLevel
+        self.latency = None
+        self.frames = 0
+        self.overBudget = 0
+        self._sinceChange = 0
+        self.preprocess = preprocess
+        self._preprocessor = None
+        self._tracker = None
+
+    def step(self, frame):
+        """Processes one raw frame
+        args:
+            frame (np.ndarray): raw video frame
+        returns:
+            (tuple): (decision dict with "latency_ms", "level", "lanes", "center", "direction", 1912x535 frame)
+                with preprocess the frame is a reused buffer that the next step() overwrites
+        """
+        start = time.perf_counter()
+        level = self.level
+        overlays, pyramidLevel, track = LEVELS[level]
+        if self.preprocess:
+            size = (frame.shape[1], frame.shape[0])
+            if self._preprocessor is None or self._preprocessor.inputSize != size:
+                self._preprocessor = lane_detection.Preprocessor(size, detectArgs = self.detectArgs)
+            frameContext = self._preprocessor.process(frame)
+        else:
+            resized = cv2.resize(frame, (1912, 1069))
+            frameContext = lane_detection.FrameContext(resized[int(resized.shape[0]/2) :])
+        img = frameContext.image
+        if track:
+            if self._tracker is None:
+                self._tracker = lane_tracking.LaneTracker(self.detectArgs)
+            _, lanes = self._tracker.update(frameContext, draw = overlays)
+        else:
+            self._tracker = None # a lane tracked before the last level change is stale
+            lines = lane_detection.detect_lines(frameContext, *self.detectArgs, level = pyramidLevel, asArray = True, draw = overlays)
+            lanes = lane_detection.detect_lanes(frameContext, lines)
+        center = direction = None
+        if len(lanes) != 0:
+            if track and self._tracker.tracking:
+                center = self._tracker.center(img)
+            else:
+                center = lane_following.get_lane_center(frameContext, lanes)
+            direction = lane_following.recommend_direction(frameContext, center[1], center[0])[0]
+        if overlays:
+            lane_detection.draw_lanes(img, lanes)
+            if center is not None:
+                lane_following.draw_lane_center(img, center)
+        latency = time.perf_counter() - start
+        self._adapt(latency)
+        decision = {
+            "latency_ms": round(latency * 1000, 2),
+            "level": level,
+            "lanes": len(lanes),
+            "center": None if center is None else [float(center[0]), float(center[1])],
+            "direction": direction,
+        }
+        return decision, img
+
+    def _adapt(self, latency):
+        # follow a running average so a single slow frame doesn't flip the level
+        self.frames += 1
+        if latency > self.budget:
+            self.overBudget += 1
+        self.latency = latency if self.latency is None else self.smoothing * latency + (1 - self.smoothing) * self.latency
+        self._sinceChange += 1
+        if self._sinceChange < self.settle:
+            return
+        if self.latency > self.budget and self.level < len(LEVELS) - 1:
+            self.level += 1
+        elif self.latency < self.budget / 2 and self.level > self.minLevel:
+            self.level -= 1
+        else:
+            return
+        self._sinceChange = 0
+        self.latency = None
+
+
+def run(source, output = sys.stdout, rate = 10.0, budget = None, detectArgs = DETECT_ARGS, videoPath = None, maxFrames = None, replay = False, speed = 1.0, preprocess = False):
+    """Runs lane following on a source and writes one JSON line per steering decision
+    args:
+        source (str or FrameSource): anything FrameSource accepts
+        output (file): where decisions are written (default sys.stdout)
+        rate (float): target decisions per second, 0 runs as fast as possible (default 10.0)
+        budget (float): per-frame latency budget in seconds (default: the frame period, or 0.1 without a rate)
+        detectArgs (tuple): parameters passed to detect_lines (default DETECT_ARGS)
+        videoPath (str): also write the processed frames (with overlays while within budget) to this video (default None)
+        maxFrames (int): stop after this many frames (default None)
+        replay (bool): replay a file or directory at its own frame rate, see FrameSource (default False)
+        speed (float): replay speed multiplier (default 1.0)
+        preprocess (bool): use the buffer reusing lane_detection.Preprocessor, see Runner (default False)
+    returns:
+        (dict): {"frames", "over_budget", "mean_latency_ms", "levels"} where levels counts frames per ladder level
+    """
+    frames = source if isinstance(source, FrameSource) else FrameSource(source, replay, speed)
+    period = 1 / rate if rate else 0
+    runner = Runner(detectArgs, budget or period or 0.1, overlays = videoPath is not None, preprocess = preprocess)
+    writer = None
+    if videoPath:
+        writer = video_pipeline.AsyncVideoWriter(cv2.VideoWriter(videoPath, cv2.VideoWriter_fourcc(*'XVID'), rate or 30, (1912, 535)), policy='drop')
+    levels = [0] * len(LEVELS)
+    totalLatency = 0.0
+    try:
+        nextTime = time.monotonic()
+        while maxFrames is None or runner.frames < maxFrames:
+            frame, timestamp = frames.read()
+            if frame is None:
+                break
+            decision, img = runner.step(frame)
+            decision = {"time": time.time(), "frame": runner.frames, "frame_time": timestamp, **decision}
+            output.write(json.dumps(decision) + "\n")
+            output.flush()
+            levels[decision["level"]] += 1
+            totalLatency += decision["latency_ms"]
+            if writer is not None:
+                writer.write(img.copy())
+            nextTime += period
+            delay = nextTime - time.monotonic()
+            if delay > 0:
+                time.sleep(delay)
+            else:
+                nextTime = time.monotonic() # behind schedule, don't try to catch up
+    finally:
+        frames.release()
+        if writer is not None:
+            writer.release()
+    return {
+        "frames": runner.frames,
+        "over_budget": runner.overBudget,
+        "mean_latency_ms": totalLatency / runner.frames if runner.frames else 0.0,
+        "levels": levels,
+    }
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Lane following on a video file, frame directory, dataset, RTSP URL or the BlueRov UDP stream")
+    parser.add_argument("source", help="video file, frame directory, .frames dataset, rtsp:// URL or udp[:port]")
+    parser.add_argument("--rate", type=float, default=10.0, help="target decisions per second, 0 for as fast as possible")
+    parser.add_argument("--budget-ms", type=float, help="per-frame latency budget (default: the frame period)")
+    parser.add_argument("--params", type=int, nargs="+", default=list(DETECT_ARGS), help="detect_lines parameters")
+    parser.add_argument("--output", type=str, help="write decisions to this JSON lines file instead of stdout")
+    parser.add_argument("--video", type=str, help="also write the processed frames to this video")
+    parser.add_argument("--max-frames", type=int, help="stop after this many frames")
+    parser.add_argument("--replay", action="store_true", help="replay a file or directory at its own frame rate like a live stream")
+    parser.add_argument("--speed", type=float, default=1.0, help="replay speed multiplier")
+    parser.add_argument("--preprocess", action="store_true", help="crop before resizing into reused buffers: faster, but finds only 50%% of the lanes with 67%% precision (regression.py)")
+    args = parser.parse_args()
+
+    output = open(args.output, 'w') if args.output else sys.stdout
+    try:
+        summary = run(args.source, output, args.rate, args.budget_ms / 1000 if args.budget_ms else None, tuple(args.params),
+                      args.video, args.max_frames, args.replay, args.speed, args.preprocess)
+    except KeyboardInterrupt:
+        summary = None
+    finally:
+        if args.output:
+            output.close()
+    if summary:
+        print(f"{summary['frames']} frames, {summary['over_budget']} over budget, mean {summary['mean_latency_ms']:.1f} ms, "
+              f"frames per level {summary['levels']}", file=sys.stderr)
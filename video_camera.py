@@ -3,12 +3,30 @@
 BlueRov video capture class
 """
 
+import threading
+
 import cv2
-import gi
 import numpy as np
 
-gi.require_version('Gst', '1.0')
-from gi.repository import Gst
+# GStreamer is only imported once a Video is created, so modules that merely
+# import this one (and pool workers) don't pay for gi at startup
+Gst = None
+
+
+def _load_gst():
+    """Import and initialise GStreamer on first use
+
+    Returns:
+        module: gi.repository.Gst
+    """
+    global Gst
+    if Gst is None:
+        import gi
+        gi.require_version('Gst', '1.0')
+        from gi.repository import Gst as _Gst
+        _Gst.init(None)
+        Gst = _Gst
+    return Gst
 
 
 class Video():
@@ -23,20 +41,41 @@ class Video():
         video_sink_conf (string): Sink configuration
         video_source (string): Udp source ip and port
         latest_frame (np.ndarray): Latest retrieved video frame
+        buffer_mode (string): How samples are turned into frames, see __init__
     """
 
-    def __init__(self, port=5600):
+    def __init__(self, port=5600, buffer_mode='copy', ring_size=3):
         """Summary
 
         Args:
             port (int, optional): UDP port
+            buffer_mode (string, optional): 'ring' copies each sample into a
+                preallocated ring of ndarrays, 'map' hands out the mapped
+                GStreamer buffer without copying, 'copy' (default) allocates
+                a new array per sample. In 'ring' and 'map' mode a frame
+                returned by frame() is only valid until the next call to
+                frame(). 'map' frames are read-only, copy them before
+                anything draws on them (detect_lines does in place).
+            ring_size (int, optional): Number of reusable arrays in 'ring'
+                mode, at least 3
         """
 
-        Gst.init(None)
+        if buffer_mode not in ('ring', 'map', 'copy'):
+            raise ValueError('buffer_mode must be ring, map or copy, not {}'.format(buffer_mode))
+
+        _load_gst()
 
         self.port = port
+        self.buffer_mode = buffer_mode
         self.latest_frame = self._new_frame = None
 
+        # Handoff state between the GStreamer thread and frame(), each frame
+        # travels with a handle: its ring slot index or its (buffer, map info)
+        self._lock = threading.Lock()
+        self._new_handle = self._latest_handle = None
+        self._ring = []
+        self._ring_size = max(3, ring_size)
+
         # [Software component diagram](https://www.ardusub.com/software/components.html)
         # UDP video stream (:5600)
         self.video_source = 'udpsrc port={}'.format(self.port)
@@ -102,16 +141,65 @@ class Video():
             buffer=buf.extract_dup(0, buf.get_size()), dtype=np.uint8)
         return array
 
+    @staticmethod
+    def _sample_shape(sample):
+        caps_structure = sample.get_caps().get_structure(0)
+        return (caps_structure.get_value('height'), caps_structure.get_value('width'), 3)
+
+    def _map_sample(self, sample):
+        """Map a sample's buffer and wrap it in an array without copying
+
+        Returns:
+            (np.ndarray, tuple): frame and (buffer, map info) handle that
+                has to be passed to _release() once the frame is unused
+        """
+        buf = sample.get_buffer()
+        ok, map_info = buf.map(Gst.MapFlags.READ)
+        if not ok:
+            return None, None
+        shape = self._sample_shape(sample)
+        array = np.frombuffer(map_info.data, dtype=np.uint8, count=shape[0] * shape[1] * 3).reshape(shape)
+        return array, (buf, map_info)
+
+    def _copy_to_ring(self, sample):
+        """Copy a sample into a ring slot the consumer is not using
+
+        Returns:
+            (np.ndarray, int): frame and its ring slot index
+        """
+        shape = self._sample_shape(sample)
+        if not self._ring or self._ring[0].shape != shape:
+            self._ring = [np.empty(shape, dtype=np.uint8) for _ in range(self._ring_size)]
+        with self._lock:
+            busy = (self._new_handle, self._latest_handle)
+        slot = next(i for i in range(len(self._ring)) if i not in busy)
+
+        frame, handle = self._map_sample(sample)
+        if frame is None:
+            return None, None
+        np.copyto(self._ring[slot], frame)
+        self._release(handle)
+        return self._ring[slot], slot
+
+    def _release(self, handle):
+        """Unmap a buffer handed out in 'map' mode, ring slots need nothing"""
+        if isinstance(handle, tuple):
+            buf, map_info = handle
+            buf.unmap(map_info)
+
     def frame(self):
         """ Get Frame
 
         Returns:
             np.ndarray: latest retrieved image frame
         """
-        if self.frame_available:
-            self.latest_frame = self._new_frame
-            # reset to indicate latest frame has been 'consumed'
-            self._new_frame = None
+        if self.frame_available():
+            with self._lock:
+                old_handle = self._latest_handle
+                self.latest_frame, self._latest_handle = self._new_frame, self._new_handle
+                # reset to indicate latest frame has been 'consumed'
+                self._new_frame = self._new_handle = None
+            self._release(old_handle)
         return self.latest_frame
 
     def frame_available(self):
@@ -138,7 +226,20 @@ class Video():
 
     def callback(self, sink):
         sample = sink.emit('pull-sample')
-        self._new_frame = self.gst_to_opencv(sample)
+        if self.buffer_mode == 'ring':
+            frame, handle = self._copy_to_ring(sample)
+        elif self.buffer_mode == 'map':
+            frame, handle = self._map_sample(sample)
+        else:
+            frame, handle = self.gst_to_opencv(sample), None
+        if frame is None:
+            return Gst.FlowReturn.OK
+
+        with self._lock:
+            # an unconsumed frame is dropped, like appsink's drop=true
+            old_handle = self._new_handle
+            self._new_frame, self._new_handle = frame, handle
+        self._release(old_handle)
 
         return Gst.FlowReturn.OK
 
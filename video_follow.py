@@ -1,38 +1,39 @@
 import cv2
-from matplotlib import pyplot as plt
-import numpy as np
-import lane_detection
 import lane_following
+import video_pipeline
 
-def videoDetection(vid, framesInVid):
-    output_video = cv2.VideoWriter('output_videoo.avi', cv2.VideoWriter_fourcc(*'XVID'), 30, (1912, 535))
+def videoDetection(vid, framesInVid, workers = None, queueDepth = 8, outputPath = 'output_videoo.avi', verbose = False, writePolicy = None, gate = None):
+    if workers and gate is not None:
+        raise ValueError("a motion gate needs frames in order, it can't be used with workers")
+    output_video = cv2.VideoWriter(outputPath, cv2.VideoWriter_fourcc(*'XVID'), 30, (1912, 535))
+    if writePolicy:
+        output_video = video_pipeline.AsyncVideoWriter(output_video, queueDepth, writePolicy)
     # video.release() #Save video to disk.
     # total_frames = []
     # Capture frame-by-frame
     count = 1
     if framesInVid == 0:
-        vid.get(cv2.CAP_PROP_FRAME_COUNT)
+        framesInVid = int(vid.get(cv2.CAP_PROP_FRAME_COUNT))
+    detectArgs = (30, 100, 3, 229, 13)
+
+    if workers:
+        process = lambda frame: lane_following.process_frame(frame, detectArgs, drawCenter = False)
+        video_pipeline.run_pipeline(vid, process, output_video.write, workers, queueDepth, maxFrames = framesInVid - 1)
+        output_video.release()
+        return
+
     while True:
         ret, frame = vid.read()
         if ret:
-            resized = (cv2.resize(frame, (1912, 1069)))
-            h = resized.shape[0]
-            w = resized.shape[1]
-            againResized = resized[int(h/2) : h, 0 : w]
-        
-            lines = lane_detection.detect_lines(againResized, 30, 100, 3, 229, 13)
-            if lines is not None:
-                lanes = lane_detection.detect_lanes(againResized, lines)
-            else:
-                lanes = []
-            frame = lane_detection.draw_lanes(againResized, lanes)
+            frame = lane_following.process_frame(frame, detectArgs, drawCenter = False, gate = gate)
             # total_frames.append(frame)
             output_video.write(frame)
-        print(count)
+        if verbose:
+            print(count)
         count += 1
         if count >= framesInVid: break # NOTE TO CHECK THIS OVER BECAUSE I DUNNO IF ITS >= OR ==
     output_video.release()
 
 if __name__ == "__main__":
     vid = cv2.VideoCapture('AUV_Vid.mkv')
-    videoDetection(vid)
+    videoDetection(vid, int(vid.get(cv2.CAP_PROP_FRAME_COUNT)))
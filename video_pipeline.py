@@ -0,0 +1,167 @@
+"""Staged multi-threaded video processing: decode -> detection workers -> ordered encode,
+and a background VideoWriter so encoding never runs on the detection thread
+
+OpenCV releases the GIL inside its image functions, so a pool of plain threads
+is enough to spread detection across cores.
+"""
+import queue
+import threading
+
+_DONE = object()
+
+
+def run_pipeline(vid, process, write, workers = 4, queueDepth = 8, maxFrames = None):
+    """Runs process() on every frame of a video using a pool of worker threads and passes the results to write() in frame order
+    args:
+        vid (cv2.VideoCapture): video that frames are decoded from
+        process (function): takes a frame (np.ndarray) and returns the processed frame
+        write (function): called with each processed frame, in the order they were decoded
+        workers (int): number of detection worker threads (default 4)
+        queueDepth (int): maximum number of frames waiting between two stages (default 8)
+        maxFrames (int): stop after this many frames (default None, the whole video)
+    returns:
+        (int): number of frames written
+    """
+    workers = max(1, int(workers))
+    frameQueue = queue.Queue(maxsize = queueDepth)
+    resultQueue = queue.Queue(maxsize = queueDepth)
+    stop = threading.Event()
+
+    def put(q, item):
+        # keeps checking stop so a failed stage can't leave the others blocked forever
+        while not stop.is_set():
+            try:
+                q.put(item, timeout = 0.1)
+                return True
+            except queue.Full:
+                pass
+        return False
+
+    def get(q):
+        while not stop.is_set():
+            try:
+                return q.get(timeout = 0.1)
+            except queue.Empty:
+                pass
+        return _DONE
+
+    def decode():
+        count = 0
+        try:
+            while not stop.is_set() and (maxFrames is None or count < maxFrames):
+                ret, frame = vid.read()
+                if not ret:
+                    break
+                if not put(frameQueue, (count, frame)):
+                    return
+                count += 1
+        except Exception as error:
+            put(resultQueue, (count, error))
+        finally:
+            # the workers only finish, and with them the encode stage, once they get _DONE
+            for _ in range(workers):
+                put(frameQueue, _DONE)
+
+    def detect():
+        while True:
+            item = get(frameQueue)
+            if item is _DONE:
+                put(resultQueue, _DONE)
+                return
+            index, frame = item
+            try:
+                result = process(frame)
+            except Exception as error:
+                put(resultQueue, (index, error))
+                return
+            if not put(resultQueue, (index, result)):
+                return
+
+    threads = [threading.Thread(target = decode, daemon = True)]
+    threads += [threading.Thread(target = detect, daemon = True) for _ in range(workers)]
+    for thread in threads:
+        thread.start()
+
+    # encode stage: reorder finished frames and write them in sequence
+    pending = {}
+    nextIndex = 0
+    running = workers
+    try:
+        while running:
+            item = resultQueue.get()
+            if item is _DONE:
+                running -= 1
+                continue
+            index, result = item
+            if isinstance(result, Exception):
+                raise result
+            pending[index] = result
+            while nextIndex in pending:
+                write(pending.pop(nextIndex))
+                nextIndex += 1
+    finally:
+        stop.set()
+        for thread in threads:
+            thread.join()
+    return nextIndex
+
+
+class AsyncVideoWriter():
+    """Writes frames to a cv2.VideoWriter on a background thread behind a bounded queue
+    args:
+        writer (cv2.VideoWriter): writer frames are passed to, anything with write() and release() works
+        queueDepth (int): maximum frames waiting to be encoded (default 8)
+        policy (str): what write() does when the queue is full, 'block' waits for room, 'drop' skips the frame (default 'block')
+    """
+
+    def __init__(self, writer, queueDepth = 8, policy = 'block'):
+        if policy not in ('block', 'drop'):
+            raise ValueError(f"policy must be 'block' or 'drop', not {policy!r}")
+        self.writer = writer
+        self.policy = policy
+        self.written = 0
+        self.dropped = 0
+        self._queue = queue.Queue(maxsize = queueDepth)
+        self._error = None
+        self._thread = threading.Thread(target = self._run, daemon = True)
+        self._thread.start()
+
+    def _run(self):
+        while True:
+            frame = self._queue.get()
+            if frame is _DONE:
+                return
+            if self._error is not None:
+                continue # keep draining so write() never blocks forever
+            try:
+                self.writer.write(frame)
+                self.written += 1
+            except Exception as error:
+                self._error = error
+
+    def write(self, frame):
+        """Queues a frame to be written, the frame must not be changed afterwards
+        args:
+            frame (np.ndarray): frame to write
+        returns:
+            (bool): False if the frame was dropped because the queue was full
+        """
+        if self._error is not None:
+            raise self._error
+        if self.policy == 'drop':
+            try:
+                self._queue.put_nowait(frame)
+            except queue.Full:
+                self.dropped += 1
+                return False
+        else:
+            self._queue.put(frame)
+        return True
+
+    def release(self):
+        """Writes the queued frames, stops the thread and releases the writer"""
+        self._queue.put(_DONE)
+        self._thread.join()
+        self.writer.release()
+        if self._error is not None:
+            raise self._error